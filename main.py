@@ -1,3 +1,4 @@
+from src.utils.startup import startup_mark
 from nicegui import ui
 from src.ui.main_layout import create_layout
 
@@ -6,6 +7,7 @@ ui.page_title('Re:Novel AI')
 
 # 加载布局
 create_layout()
+startup_mark("布局构建完成")
 
 # 启动应用
 if __name__ in {"__main__", "__mp_main__"}:
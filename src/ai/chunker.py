@@ -0,0 +1,89 @@
+import zlib
+
+# 每个向量块的目标 token 数与相邻块的重叠 token 数
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP = 40
+# 少于此字数的行不单独入库 (沿用旧规则：过滤短句)
+MIN_LINE_CHARS = 6
+# 块长度达到目标的一半后，遇到“锚点行”就切块；锚点只由行内容决定，
+# 改动一段只会影响附近的块，后面的块边界会重新对齐，增量索引可以复用向量
+ANCHOR_MODULUS = 4
+TIKTOKEN_ENCODING = "cl100k_base"
+
+class Chunker:
+    """
+    把章节的行合并成按 token 计长的滑动窗口，每块记录覆盖的行号范围 (与章节分段的 seg_index 一致)。
+    tiktoken 不可用 (未安装 / 离线无法加载词表) 时按字符数估算。
+    """
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP, min_line_chars: int = MIN_LINE_CHARS):
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.min_line_chars = min_line_chars
+        self._enc = None
+        try:
+            import tiktoken
+            self._enc = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception as e:
+            print(f"[RAG] tiktoken 不可用，按字符数估算 token: {e}")
+
+    def count(self, text: str) -> int:
+        if self._enc: return len(self._enc.encode(text, disallowed_special=()))
+        return len(text)
+
+    def _split_long(self, text: str):
+        """单行超过上限时按 token 切开"""
+        if self._enc:
+            tokens = self._enc.encode(text, disallowed_special=())
+            parts, start = [], 0
+            while start < len(tokens):
+                start, part = self._clean_cut(tokens, start, min(start + self.max_tokens, len(tokens)))
+                parts.append(part)
+            return parts
+        return [text[i:i + self.max_tokens] for i in range(0, len(text), self.max_tokens)]
+
+    def _clean_cut(self, tokens, start: int, end: int):
+        """
+        字节级 BPE 的一个汉字可能跨两三个 token，直接按上限切会截断字符：
+        切点从 end 往回挪到能完整解码处 (上限小于一个字符所需的 token 数时往后挪)，返回 (切点, 文本)
+        """
+        for cut in [*range(end, start, -1), *range(end + 1, len(tokens) + 1)]:
+            try: return cut, self._enc.decode_bytes(tokens[start:cut]).decode('utf-8')
+            except UnicodeDecodeError: continue
+        return len(tokens), self._enc.decode_bytes(tokens[start:]).decode('utf-8', 'replace')
+
+    @staticmethod
+    def _is_anchor(line: str) -> bool:
+        return zlib.crc32(line.encode('utf-8')) % ANCHOR_MODULUS == 0
+
+    def chunk(self, text: str):
+        """返回 [{'text', 'line_start', 'line_end', 'tokens'}]，行号为非空行的序号 (含首尾)"""
+        lines = [line.strip() for line in (text or "").split('\n') if line.strip()]
+        items = [(i, line, self.count(line)) for i, line in enumerate(lines) if len(line) >= self.min_line_chars]
+        chunks = []
+        window, size = [], 0
+
+        def emit():
+            nonlocal window, size
+            if not window: return
+            chunks.append({'text': "\n".join(l for _, l, _ in window), 'line_start': window[0][0],
+                           'line_end': window[-1][0], 'tokens': size})
+            # 重叠：下一块以本块末尾若干行开头
+            tail, tail_size = [], 0
+            for item in reversed(window[1:]):
+                if tail_size + item[2] > self.overlap: break
+                tail.insert(0, item); tail_size += item[2]
+            window, size = tail, tail_size
+
+        for line_no, line, n in items:
+            if n > self.max_tokens:
+                emit(); window, size = [], 0
+                for part in self._split_long(line):
+                    chunks.append({'text': part, 'line_start': line_no, 'line_end': line_no, 'tokens': self.count(part)})
+                continue
+            if size + n > self.max_tokens: emit()
+            if size + n > self.max_tokens: window, size = [], 0  # 重叠部分也放不下
+            window.append((line_no, line, n)); size += n
+            if size >= self.max_tokens // 2 and self._is_anchor(line): emit()
+        # 末尾只剩重叠行时不再单独成块
+        if window and (not chunks or window[-1][0] > chunks[-1]['line_end']): emit()
+        return chunks
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+import numpy as np
+
+# 持久化嵌入缓存：同一段文字在副本 / 批量副本 / 重新导入之间只嵌入一次 (放在向量库目录下)
+CACHE_FILE = "embedding_cache.db"
+# 上限条数 (MiniLM 384 维 float32 约 1.5KB/条)
+MAX_ENTRIES = 200000
+# 每写入多少条检查一次上限，超出时按最近使用时间淘汰一成
+EVICT_CHECK_EVERY = 1000
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class CachedEmbeddingFunction:
+    """
+    包装 Chroma 的嵌入函数，键为 (模型 id, 文本哈希)。
+    upsert(documents=...) 与 query(query_texts=...) 都会经过这里，未命中的文本才交给原函数批量计算。
+    """
+    def __init__(self, inner, model_id: str, path: str, max_entries: int = MAX_ENTRIES):
+        self.inner = inner
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vec BLOB NOT NULL, -- float32
+                used_at REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            ) WITHOUT ROWID
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_used ON embeddings(used_at)")
+        self._db.commit()
+
+    def __call__(self, input):
+        keys = [text_key(t) for t in input]
+        found = self._lookup(set(keys))
+        missing = [i for i, k in enumerate(keys) if k not in found]
+        if missing:
+            computed = self.inner([input[i] for i in missing])
+            fresh = {}
+            for i, vec in zip(missing, computed):
+                fresh[keys[i]] = np.asarray(vec, dtype=np.float32)
+            self._store(fresh)
+            found.update(fresh)
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return [found[k] for k in keys]
+
+    # Chroma 1.x 在建 / 取集合与查询时会调用下面几个接口：
+    # 名称沿用原嵌入函数 (向量完全相同，已有集合不会报冲突)；无法从配置重建，按旧式嵌入函数登记
+    def name(self):
+        name = getattr(self.inner, 'name', None)
+        return name() if callable(name) else NotImplemented
+
+    def is_legacy(self) -> bool:
+        return True
+
+    def embed_query(self, input):
+        return self(input)
+
+    def _lookup(self, keys):
+        if not keys: return {}
+        found = {}
+        key_list = list(keys)
+        with self._lock:
+            # SQLite 参数上限，分批 IN 查询
+            for i in range(0, len(key_list), 500):
+                part = key_list[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    (self.model_id, *part)
+                ).fetchall()
+                for h, vec in rows: found[h] = np.frombuffer(vec, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE embeddings SET used_at = ? WHERE model = ? AND hash = ?",
+                    [(now, self.model_id, h) for h in found])
+                self._db.commit()
+        return found
+
+    def _store(self, vectors: dict):
+        now = time.time()
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (model, hash, vec, used_at) VALUES (?, ?, ?, ?)",
+                [(self.model_id, h, vec.tobytes(), now) for h, vec in vectors.items()])
+            self._writes += len(vectors)
+            if self._writes >= EVICT_CHECK_EVERY:
+                self._writes = 0
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries: return
+        drop = count - self.max_entries * 9 // 10
+        self._db.execute(
+            "DELETE FROM embeddings WHERE used_at <= (SELECT used_at FROM embeddings ORDER BY used_at ASC LIMIT 1 OFFSET ?)", (drop - 1,)
+        )
+        print(f"[RAG Cache] 嵌入缓存超出上限，已淘汰约 {drop} 条")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
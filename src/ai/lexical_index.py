@@ -0,0 +1,76 @@
+import re
+import math
+import heapq
+from collections import Counter
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r'[㐀-鿿豈-﫿]+|[a-z0-9]+')
+
+def tokenize(text: str):
+    """中文按字二元组 (单字的片段保留单字)，英文/数字按词；人名、物名这类短词靠二元组精确命中"""
+    terms = []
+    for run in _TOKEN_RE.findall((text or "").lower()):
+        if run[0].isascii():
+            terms.append(run)
+        elif len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+class LexicalIndex:
+    """单个项目的内存 BM25 倒排索引，支持按 id 增删 (与向量集合的 upsert/delete 同步)"""
+    def __init__(self):
+        self.postings = {}   # term -> {doc_id: tf}
+        self.docs = {}       # doc_id -> (text, metadata)
+        self.doc_terms = {}  # doc_id -> Counter
+        self.doc_len = {}
+        self.doc_order = {}  # doc_id -> 章节 order_index (检索时按章节先后剪枝)
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id: str, text: str, metadata=None):
+        if doc_id in self.docs: self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        self.docs[doc_id] = (text, metadata or {})
+        self.doc_terms[doc_id] = terms
+        self.doc_len[doc_id] = sum(terms.values())
+        self.doc_order[doc_id] = (metadata or {}).get('order_index')
+        self.total_len += self.doc_len[doc_id]
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id: str):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None: return
+        self.docs.pop(doc_id, None)
+        self.doc_order.pop(doc_id, None)
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None: continue
+            posting.pop(doc_id, None)
+            if not posting: del self.postings[term]
+
+    def search(self, query: str, k: int = 10, max_order: int = None):
+        """返回 [(doc_id, score)]，按 BM25 分数降序；max_order 给定时只在该章及之前的文档里取前 k 条"""
+        n = len(self.docs)
+        if not n: return []
+        avgdl = self.total_len / n or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting: continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if max_order is not None:
+                    order = self.doc_order[doc_id]
+                    if order is None or order > max_order: continue
+                dl = self.doc_len[doc_id]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl))
+        return heapq.nlargest(k, scores.items(), key=lambda x: x[1])
@@ -1,28 +1,103 @@
 import httpx
 import os
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
+import asyncio
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from src.ai.llm_scheduler import scheduler, estimate_tokens, is_rate_limited, is_transient, transient_delay, retry_after, MAX_RETRIES
+
+# langchain 与各家 SDK 导入很慢，首次调用 (或启动后台预热) 时再加载
+ChatOpenAI = ChatGoogleGenerativeAI = HumanMessage = SystemMessage = None
+
+def load_sdk():
+    global ChatOpenAI, ChatGoogleGenerativeAI, HumanMessage, SystemMessage
+    if SystemMessage is not None: return
+    from langchain_openai import ChatOpenAI as _ChatOpenAI
+    from langchain_google_genai import ChatGoogleGenerativeAI as _ChatGoogle
+    from langchain_core.messages import HumanMessage as _Human, SystemMessage as _System
+    ChatOpenAI, ChatGoogleGenerativeAI, HumanMessage = _ChatOpenAI, _ChatGoogle, _Human
+    SystemMessage = _System
+
+# 影响模型客户端构造的配置项 (system_prompt 等按消息传，不进指纹)
+CLIENT_KEYS = ('provider', 'api_key', 'base_url', 'model', 'temperature', 'top_p', 'presence_penalty', 'frequency_penalty', 'proxy')
+# 缓存的模型客户端个数上限 (各角色 × 设置改动，超出按最近使用淘汰)
+MAX_CACHED_CLIENTS = 32
+# 共享连接池：按代理地址各一个，保持长连接，省去每次调用的 TCP/TLS 握手
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(120, connect=10)
+
+def _system_proxy():
+    """
+    导入时的系统代理与 NO_PROXY 快照。Google 角色会把自己的代理写进环境变量，
+    之后新建的连接池若再读环境 (trust_env) 就会串用它，所以直连池只认这份快照。
+    返回 (代理地址, 直连的 URL 模式列表)，'*' 表示全部直连。
+    """
+    proxy = next((os.environ[k] for k in ('HTTPS_PROXY', 'https_proxy', 'ALL_PROXY', 'all_proxy', 'HTTP_PROXY', 'http_proxy') if os.environ.get(k)), '')
+    patterns = []
+    for host in (os.environ.get('NO_PROXY') or os.environ.get('no_proxy') or '').split(','):
+        host = host.strip()
+        if host == '*': return '', []
+        if not host: continue
+        if '://' in host: patterns.append(host)
+        elif host == 'localhost' or all(ch.isdigit() or ch in '.:' for ch in host): patterns.append(f"all://{host}")
+        else: patterns.append(f"all://*{host}")  # 同时匹配域名本身与子域名
+    return proxy, patterns
+
+SYSTEM_PROXY, SYSTEM_NO_PROXY = _system_proxy()
+
+_clients = OrderedDict()  # 指纹 -> 模型客户端
+_pools = {}               # 代理 ('' 为直连) -> (httpx.Client, httpx.AsyncClient)
+_lock = threading.Lock()
+
+def config_fingerprint(config: dict) -> str:
+    data = {k: config.get(k) for k in CLIENT_KEYS}
+    data['proxy'] = (data['proxy'] or '').strip()
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _new_http(cls, proxy: str):
+    # 代理绑定在客户端上，从不读取 (可能被 Google 角色改写的) 环境变量；未配置代理时用启动时的系统代理
+    kwargs = {'limits': HTTP_LIMITS, 'timeout': HTTP_TIMEOUT, 'trust_env': False}
+    if not proxy:
+        if not SYSTEM_PROXY: return cls(**kwargs)
+        proxy = SYSTEM_PROXY
+        kwargs['mounts'] = {pattern: None for pattern in SYSTEM_NO_PROXY}  # None：走默认 (直连) 传输
+    try: return cls(proxy=proxy, **kwargs)
+    except TypeError: return cls(proxies=proxy, **kwargs)  # httpx < 0.26
+
+def http_pool(proxy: str = ''):
+    """取 (同步, 异步) 共享 httpx 客户端"""
+    proxy = (proxy or '').strip()
+    with _lock:
+        pool = _pools.get(proxy)
+        if pool is None:
+            pool = _pools[proxy] = (_new_http(httpx.Client, proxy), _new_http(httpx.AsyncClient, proxy))
+            if proxy: print(f"[LLMClient] 已为代理 {proxy} 建立连接池")
+        return pool
+
+def _apply_env_proxy(proxy: str):
+    """Google REST 传输只读环境变量里的代理，无法按客户端绑定，仍需设置进程级代理"""
+    if not proxy or os.environ.get('HTTPS_PROXY') == proxy: return
+    for key in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'): os.environ[key] = proxy
+    print(f"[LLMClient] 已启用代理 (Google): {proxy}")
+
+async def close_pools():
+    """关闭共享连接池并清空客户端缓存 (app.on_shutdown)"""
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        _clients.clear()
+    for sync_client, async_client in pools:
+        sync_client.close()
+        await async_client.aclose()
 
 class LLMClient:
+    """无状态外观：模型客户端与连接池在模块级共享，图谱 / 角色卡转换等各自 new 出来的实例也能复用"""
     def __init__(self):
         pass
 
-    def _apply_proxy(self, config: dict):
-        """强制设置代理环境变量"""
-        proxy = config.get('proxy', '').strip()
-        if proxy:
-            # 这里的 key 必须覆盖全，以防万一
-            os.environ['http_proxy'] = proxy
-            os.environ['https_proxy'] = proxy
-            os.environ['HTTP_PROXY'] = proxy
-            os.environ['HTTPS_PROXY'] = proxy
-            print(f"[LLMClient] 已启用代理: {proxy}")
-
     async def get_available_models(self, config: dict) -> list:
         provider = config.get('provider', 'openai')
-        self._apply_proxy(config) # 应用代理
-        
         if provider != 'openai': return []
         api_key = config.get('api_key', '')
         base_url = config.get('base_url', 'https://api.openai.com/v1')
@@ -34,30 +109,44 @@ class LLMClient:
             else: url = f"{base_url}/v1/models"
             headers = {"Authorization": f"Bearer {api_key}"}
             
-            async with httpx.AsyncClient(trust_env=True) as client:
-                resp = await client.get(url, headers=headers, timeout=5)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return [item['id'] for item in data.get('data', [])]
+            _, client = http_pool(config.get('proxy', ''))
+            resp = await client.get(url, headers=headers, timeout=5)
+            if resp.status_code == 200:
+                data = resp.json()
+                return [item['id'] for item in data.get('data', [])]
         except: pass
         return []
 
     def _get_llm(self, config: dict):
+        """按配置指纹复用模型客户端；设置改动后指纹变化，自然换用新客户端"""
+        if not config.get('api_key', ''): raise ValueError("API Key 未设置")
+        key = config_fingerprint(config)
+        with _lock:
+            llm = _clients.get(key)
+            if llm is not None:
+                _clients.move_to_end(key)
+                return llm
+        llm = self._build_llm(config)
+        with _lock:
+            _clients[key] = llm
+            while len(_clients) > MAX_CACHED_CLIENTS: _clients.popitem(last=False)
+        return llm
+
+    def _build_llm(self, config: dict):
         provider = config.get('provider', 'openai')
         api_key = config.get('api_key', '')
-        
-        # 应用代理
-        self._apply_proxy(config)
-        
-        if not api_key: raise ValueError("API Key 未设置")
+        proxy = config.get('proxy', '').strip()
+        load_sdk()
 
         if provider == 'google':
+            _apply_env_proxy(proxy)
             return ChatGoogleGenerativeAI(
                 model=config.get('model', 'gemini-1.5-flash'),
                 google_api_key=api_key,
                 temperature=config.get('temperature', 0.7),
                 top_p=config.get('top_p', 0.9),
                 convert_system_message_to_human=True,
+                max_retries=0, # 429 / 5xx / 超时交给调度器退避重试
                 transport='rest' # 这一行对代理很重要
             )
         elif provider == 'openai':
@@ -66,7 +155,11 @@ class LLMClient:
                 'api_key': api_key,
                 'base_url': config.get('base_url', 'https://api.openai.com/v1'),
                 'temperature': config.get('temperature', 0.7),
-                'streaming': True
+                'streaming': True,
+                'max_retries': 0, # 429 / 5xx / 超时交给调度器退避重试
+                # 共享长连接池，代理随连接池绑定
+                'http_client': http_pool(proxy)[0],
+                'http_async_client': http_pool(proxy)[1],
             }
             if config.get('presence_penalty'): kwargs['presence_penalty'] = config.get('presence_penalty')
             if config.get('frequency_penalty'): kwargs['frequency_penalty'] = config.get('frequency_penalty')
@@ -74,7 +167,11 @@ class LLMClient:
         else:
             raise ValueError(f"不支持的服务商: {provider}")
 
-    async def stream_rewrite(self, text: str, instruction: str, config: dict):
+    async def aclose(self):
+        await close_pools()
+
+    async def stream_rewrite(self, text: str, instruction: str, config: dict, priority: int = None):
+        """经全局调度器排队发出；priority 为 None 时取当前任务设置的优先级 (默认交互)"""
         llm = self._get_llm(config)
         
         system_prompt_content = config.get('system_prompt', '你是一个小说助手。')
@@ -84,6 +181,24 @@ class LLMClient:
             HumanMessage(content=f"指令：{instruction}\n\n内容：\n{text}")
         ]
 
-        async for chunk in llm.astream(messages):
-            if hasattr(chunk, 'content'):
-                yield chunk.content
\ No newline at end of file
+        tokens = estimate_tokens(system_prompt_content, instruction, text)
+        for attempt in range(MAX_RETRIES + 1):
+            started = False
+            delay = 0
+            async with scheduler.slot(config, tokens, priority) as lim:
+                try:
+                    async for chunk in llm.astream(messages):
+                        if hasattr(chunk, 'content'):
+                            started = True
+                            yield chunk.content
+                    scheduler.succeeded(lim)
+                    return
+                except Exception as e:
+                    if is_rate_limited(e): scheduler.rate_limited(lim, retry_after(e))
+                    elif is_transient(e): delay = transient_delay(attempt)
+                    else: raise
+                    # 已经输出过内容就不能透明重试了
+                    if started or attempt == MAX_RETRIES: raise
+                    if delay: print(f"[LLMClient] 临时故障 ({type(e).__name__})，{delay:.1f}s 后重试")
+            # 临时故障在名额释放后再等待，不挡别的请求
+            if delay: await asyncio.sleep(delay)
\ No newline at end of file
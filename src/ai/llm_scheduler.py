@@ -0,0 +1,191 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+# 优先级：数值越小越先调度 (交互式对话 / 单段改写 > 批量精修 > 后台图谱)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+# 全局同时在途的请求上限；其中预留给交互请求的名额 (批量/后台任务占不满)
+MAX_IN_FLIGHT = 8
+INTERACTIVE_RESERVE = 2
+# 每个 (服务商, 模型) 的默认配额，角色配置里的 rpm / tpm 可覆盖
+DEFAULT_RPM = 60
+DEFAULT_TPM = 200000
+# 每个 (服务商, 模型) 的并发：从 INITIAL 起步，成功后慢慢加 (加性增)，遇到 429 减半 (乘性减)
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = 8
+# 429 未给出 Retry-After 时的退避秒数 (连续 429 翻倍，封顶)
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+# 流式输出开始前遇到 429 / 5xx / 超时 / 连接中断时自动重试的次数 (SDK 自带重试已关闭)
+MAX_RETRIES = 3
+# 视为临时故障的异常类名 (openai / httpx / google-api-core，按继承链匹配，不必导入各家 SDK)
+TRANSIENT_ERRORS = ('APIConnectionError', 'InternalServerError', 'ServerError', 'TimeoutException', 'NetworkError', 'RemoteProtocolError')
+# 预估输出 token 的下限 (按字符估算，中文约一字一 token)
+OUTPUT_RESERVE = 256
+
+_priority = contextvars.ContextVar('llm_priority', default=PRIORITY_INTERACTIVE)
+
+def estimate_tokens(*parts, output: int = None) -> int:
+    size = sum(len(p or "") for p in parts)
+    return size + (output if output is not None else max(OUTPUT_RESERVE, size // 2))
+
+def is_rate_limited(e: Exception) -> bool:
+    """OpenAI (RateLimitError.status_code)、Google (ResourceExhausted.code) 与 httpx 响应都归一到 429 判断"""
+    for attr in ('status_code', 'code', 'http_status'):
+        if getattr(e, attr, None) == 429: return True
+    response = getattr(e, 'response', None)
+    if getattr(response, 'status_code', None) == 429: return True
+    return type(e).__name__ in ('RateLimitError', 'ResourceExhausted')
+
+def is_transient(e: Exception) -> bool:
+    """服务端 5xx、超时、连接中断等可以原样重发的错误"""
+    if isinstance(e, (TimeoutError, ConnectionError)): return True
+    for code in (getattr(e, 'status_code', None), getattr(e, 'code', None), getattr(e, 'http_status', None),
+                 getattr(getattr(e, 'response', None), 'status_code', None)):
+        if isinstance(code, int) and code >= 500: return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(e).__mro__)
+
+def transient_delay(attempt: int) -> float:
+    """临时故障的退避秒数 (不占并发名额，也不降并发)"""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+
+def retry_after(e: Exception):
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try: return float(headers.get('retry-after'))
+    except (TypeError, ValueError): return None
+
+class TokenBucket:
+    """容量为每分钟配额、按秒匀速补充的令牌桶；一次取超过容量的量时按容量计 (大请求不会永远排不上)"""
+    def __init__(self, per_minute: float):
+        self.set_rate(per_minute)
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+
+    def set_rate(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+class _Limiter:
+    """单个 (服务商, 模型) 的配额、并发与排队状态"""
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = float(INITIAL_CONCURRENCY)
+        self.in_flight = 0
+        self.waiting = []  # 堆：(优先级, 序号)
+        self.blocked_until = 0.0
+        self.backoff = BACKOFF_BASE
+
+class LLMScheduler:
+    """
+    所有 stream_rewrite 调用的统一入口：按优先级排队，令牌桶限制每分钟请求数 / token 数，
+    限制全局与单模型的在途请求数，并按 429 自适应调整单模型并发。只在 NiceGUI 事件循环里使用。
+    """
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._limiters = {}
+        self._seq = itertools.count()
+        self._cond = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None: self._cond = asyncio.Condition()
+        return self._cond
+
+    def _limiter(self, config: dict) -> _Limiter:
+        key = (config.get('provider', 'openai'), config.get('model', ''))
+        rpm = config.get('rpm') or DEFAULT_RPM
+        tpm = config.get('tpm') or DEFAULT_TPM
+        lim = self._limiters.get(key)
+        if lim is None:
+            lim = self._limiters[key] = _Limiter(rpm, tpm)
+        elif lim.requests.capacity != rpm or lim.tokens.capacity != tpm:
+            lim.requests.set_rate(rpm); lim.tokens.set_rate(tpm)
+        return lim
+
+    @staticmethod
+    def priority(level: int):
+        """在当前任务 (及其派生任务) 内设置默认优先级，返回用于 reset 的 token"""
+        return _priority.set(level)
+
+    @staticmethod
+    def reset_priority(token):
+        _priority.reset(token)
+
+    def _ready_in(self, lim: _Limiter, entry, tokens: int, now: float):
+        """返回 None 表示需等待别人释放名额；否则为还需等待的秒数 (0 即可发出)"""
+        if lim.waiting[0] != entry or lim.in_flight >= int(lim.concurrency): return None
+        cap = self.max_in_flight - (INTERACTIVE_RESERVE if entry[0] > PRIORITY_INTERACTIVE else 0)
+        if self.in_flight >= cap: return None
+        return max(lim.blocked_until - now, lim.requests.wait_time(1, now), lim.tokens.wait_time(tokens, now))
+
+    @asynccontextmanager
+    async def slot(self, config: dict, tokens: int, priority: int = None):
+        """占一个请求名额 (产出该模型的限流状态)；块内调用模型，成功后调 succeeded，遇到 429 调 rate_limited"""
+        lim = self._limiter(config)
+        entry = (_priority.get() if priority is None else priority, next(self._seq))
+        cond = self._condition()
+        async with cond:
+            heapq.heappush(lim.waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._ready_in(lim, entry, tokens, now)
+                    if wait is not None and wait <= 0: break
+                    try: await asyncio.wait_for(cond.wait(), timeout=wait)
+                    except asyncio.TimeoutError: pass
+            finally:
+                lim.waiting.remove(entry)
+                heapq.heapify(lim.waiting)
+                cond.notify_all()
+            lim.requests.take(1, now)
+            lim.tokens.take(tokens, now)
+            lim.in_flight += 1
+            self.in_flight += 1
+        try:
+            yield lim
+        finally:
+            async with cond:
+                lim.in_flight -= 1
+                self.in_flight -= 1
+                cond.notify_all()
+
+    def succeeded(self, lim: _Limiter):
+        # 加性增：大约每完成 concurrency 个请求加 1
+        lim.concurrency = min(float(MAX_CONCURRENCY), lim.concurrency + 1 / lim.concurrency)
+        lim.backoff = BACKOFF_BASE
+
+    def rate_limited(self, lim: _Limiter, delay: float = None):
+        """乘性减并暂停该模型的新请求；delay 为服务端给出的 Retry-After"""
+        lim.concurrency = max(1.0, lim.concurrency / 2)
+        pause = delay if delay is not None else lim.backoff
+        lim.backoff = min(BACKOFF_MAX, lim.backoff * 2)
+        lim.blocked_until = max(lim.blocked_until, time.monotonic() + pause)
+        print(f"[LLM Scheduler] 触发限流 (429)，并发降至 {int(lim.concurrency)}，暂停 {pause:.1f}s")
+
+    def stats(self) -> dict:
+        return {'in_flight': self.in_flight, 'models': {
+            f"{p}/{m}": {'in_flight': lim.in_flight, 'concurrency': int(lim.concurrency), 'waiting': len(lim.waiting)}
+            for (p, m), lim in self._limiters.items()}}
+
+# 全局单例
+scheduler = LLMScheduler()
@@ -0,0 +1,123 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 内存 LRU 容量 (条)
+MEMORY_ENTRIES = 1024
+# 可选的磁盘缓存：跨重启保留检索结果，默认关闭 (开启时放在向量库目录下)
+DISK_FILE = "query_cache.db"
+DISK_ENTRIES = 20000
+
+_SEP_RE = re.compile(r'[\s,，、;；|/]+')
+
+def normalize_query(query: str) -> str:
+    """关键词查询归一化：统一分隔符与大小写，去重后排序 ("甲，乙" 与 "乙 甲" 命中同一条)"""
+    terms = {t for t in _SEP_RE.split((query or "").casefold()) if t}
+    return " ".join(sorted(terms))
+
+class QueryCache:
+    """
+    RAG 检索结果缓存，键为 (project_id, 归一化查询, n_results)；限定章节范围 (max_order) 的查询单独成键。
+    项目记忆变化时按项目失效；每个项目带一个代数，失效前发起、失效后才返回的查询不会写回缓存。
+    线程安全 (检索在线程池里执行)。
+    """
+    def __init__(self, max_entries: int = MEMORY_ENTRIES, disk_path: str = None, disk_entries: int = DISK_ENTRIES):
+        self.max_entries = max_entries
+        self._mem = OrderedDict()
+        self._gen = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._disk = None
+        self._disk_puts = 0
+        self.disk_entries = disk_entries
+        if disk_path:
+            try:
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+                self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+                self._disk.execute("""
+                    CREATE TABLE IF NOT EXISTS query_cache (
+                        project_id TEXT NOT NULL,
+                        query TEXT NOT NULL,
+                        n_results INTEGER NOT NULL,
+                        result TEXT NOT NULL,
+                        used_at REAL NOT NULL,
+                        PRIMARY KEY (project_id, query, n_results)
+                    ) WITHOUT ROWID
+                """)
+                self._disk.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_used ON query_cache(used_at)")
+                self._disk.commit()
+            except sqlite3.Error as e:
+                print(f"[RAG Cache] 磁盘缓存不可用: {e}")
+                self._disk = None
+
+    def generation(self, project_id: str) -> int:
+        with self._lock:
+            return self._gen.get(project_id, 0)
+
+    @staticmethod
+    def _key(project_id: str, query: str, n_results: int, max_order: int = None):
+        query = normalize_query(query)
+        if max_order is not None: query = f"{query}@{max_order}"
+        return (project_id, query, n_results)
+
+    def get(self, project_id: str, query: str, n_results: int, max_order: int = None):
+        key = self._key(project_id, query, n_results, max_order)
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return self._mem[key]
+            if self._disk:
+                row = self._disk.execute(
+                    "SELECT result FROM query_cache WHERE project_id = ? AND query = ? AND n_results = ?", key
+                ).fetchone()
+                if row:
+                    self._disk.execute("UPDATE query_cache SET used_at = ? WHERE project_id = ? AND query = ? AND n_results = ?", (time.time(), *key))
+                    self._disk.commit()
+                    self._put_mem(key, row[0])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, project_id: str, query: str, n_results: int, result: str, generation: int = None, max_order: int = None):
+        key = self._key(project_id, query, n_results, max_order)
+        with self._lock:
+            if generation is not None and generation != self._gen.get(project_id, 0): return
+            self._put_mem(key, result)
+            if self._disk:
+                self._disk.execute("INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?)", (*key, result, time.time()))
+                # 每 256 次写入检查一次上限，超出时按最近使用时间淘汰一成
+                self._disk_puts += 1
+                count = self._disk.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0] if self._disk_puts % 256 == 0 else 0
+                if count > self.disk_entries:
+                    self._disk.execute(
+                        "DELETE FROM query_cache WHERE used_at <= (SELECT used_at FROM query_cache ORDER BY used_at ASC LIMIT 1 OFFSET ?)",
+                        (count - self.disk_entries * 9 // 10,)
+                    )
+                self._disk.commit()
+
+    def _put_mem(self, key, result):
+        self._mem[key] = result
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def invalidate(self, project_id: str):
+        with self._lock:
+            self._gen[project_id] = self._gen.get(project_id, 0) + 1
+            for key in [k for k in self._mem if k[0] == project_id]:
+                del self._mem[key]
+            if self._disk:
+                self._disk.execute("DELETE FROM query_cache WHERE project_id = ?", (project_id,))
+                self._disk.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._mem),
+                    'hit_rate': self.hits / total if total else 0.0}
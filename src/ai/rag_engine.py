@@ -1,113 +1,489 @@
 import os
-import chromadb
-from chromadb.utils import embedding_functions
 import uuid
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from chromadb.utils import embedding_functions
+from src.ai.vector_store import ChromaStore, NumpyStore
+from src.ai.query_cache import QueryCache, normalize_query, DISK_FILE as QUERY_CACHE_FILE
+from src.ai.embedding_cache import CachedEmbeddingFunction, CACHE_FILE as EMBED_CACHE_FILE
+from src.ai.chunker import Chunker
+from src.ai.lexical_index import LexicalIndex
+# 容错导入 rapidfuzz (仅用于重排)
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
 
 # 数据存储路径
 DB_DIR = "data/vectordb"
+# 向量存储后端："chroma" (默认) 或 "numpy" (float16 内存映射 + 暴力/IVF 检索，冷启动快、常驻内存小)
+# 两种后端的数据互不相通，切换后需重新导入作品以重建记忆
+VECTOR_BACKEND = os.environ.get("RENOVEL_VECTOR_BACKEND", "chroma")
+# 嵌入模型标识 (嵌入缓存的键之一；换模型时旧缓存自然失效)
+EMBED_MODEL_ID = "chroma-default/all-MiniLM-L6-v2"
+# 早期所有项目共用的集合，启动时迁移到每项目一个集合
+LEGACY_COLLECTION = "novel_memory"
+COLLECTION_PREFIX = "novel_"
+MIGRATE_BATCH = 1000
+
+# 批量向量化：每次嵌入调用的段落数 / 每次写入 Chroma 的条数
+EMBED_BATCH = 128
+UPSERT_BATCH = 1024
+# 检索线程数上限 (查询嵌入 + Chroma 查询都是阻塞调用)
+QUERY_WORKERS = 4
+# 检索结果是否额外缓存到磁盘 (跨重启保留)
+QUERY_CACHE_ON_DISK = False
+# 混合检索：向量 / BM25 各取候选池，RRF 融合后按关键词模糊匹配度重排
+CANDIDATE_POOL = 12
+RRF_K = 60
+RERANK_WEIGHT = 0.5
+DEFAULT_RESULTS = 3
+# 克隆 / 导出时每页读取的条数 (内存占用与书的大小无关)
+CLONE_PAGE = 500
+
+def seg_hash(text: str) -> str:
+    """段落内容哈希，存在向量 metadata 里用于增量比对"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
 
 class RAGEngine:
-    def __init__(self):
-        print("[RAG] 正在初始化向量数据库 (ChromaDB)...")
-        self.client = chromadb.PersistentClient(path=DB_DIR)
-        self.emb_fn = embedding_functions.DefaultEmbeddingFunction()
-        self.collection = self.client.get_or_create_collection(
-            name="novel_memory",
-            embedding_function=self.emb_fn
-        )
-        print(f"[RAG] 数据库加载成功。现有记忆条目: {self.collection.count()}")
+    def __init__(self, db_dir: str = DB_DIR, backend: str = VECTOR_BACKEND, embedding_function=None):
+        print(f"[RAG] 正在初始化向量数据库 ({backend})...")
+        # 先查持久化嵌入缓存，未命中的文本才真正计算
+        self.emb_fn = CachedEmbeddingFunction(embedding_function or embedding_functions.DefaultEmbeddingFunction(), EMBED_MODEL_ID,
+                                              os.path.join(db_dir, EMBED_CACHE_FILE))
+        if backend == "numpy": self.store = NumpyStore(db_dir, self.emb_fn)
+        else: self.store = ChromaStore(db_dir, self.emb_fn)
+        # 相邻行合并成按 token 计长的重叠窗口，向量数大幅减少且每条带上下文
+        self.chunker = Chunker()
+        # 每个项目的内存 BM25 索引，首次检索时从集合加载，之后随索引增删同步
+        self._lexical = {}
+        self._lexical_lock = threading.RLock()
+        # 每个项目一个集合：检索只扫本书的索引，删除项目直接删集合
+        self._collections = {}
+        self._collections_lock = threading.Lock()
+        self.migrate_legacy_collection()
+        print(f"[RAG] 数据库加载成功。现有项目记忆: {len(self.store.list_collections())} 个")
+        # 嵌入在后台线程执行 (onnx 推理会释放 GIL)，不占用 NiceGUI 事件循环
+        self.embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-embed")
+        self.query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="rag-query")
+        # 克隆等长任务单独一个线程，不挡住保存时的增量索引
+        self.bulk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-bulk")
+        # 批量精修时同一章会反复检索相同关键词；项目记忆有变动时按项目失效
+        self.query_cache = QueryCache(disk_path=os.path.join(db_dir, QUERY_CACHE_FILE) if QUERY_CACHE_ON_DISK else None)
+        # 本次运行已补齐 order_index 的项目
+        self._order_checked = set()
+
+    @staticmethod
+    def collection_name(project_id: str) -> str:
+        return f"{COLLECTION_PREFIX}{project_id}"
+
+    def _collection(self, project_id: str, create: bool = True):
+        """取项目集合；create=False 且不存在时返回 None"""
+        with self._collections_lock:
+            col = self._collections.get(project_id)
+            if col is not None: return col
+            col = self.store.get_collection(self.collection_name(project_id), create)
+            if col is None: return None
+            self._collections[project_id] = col
+            return col
 
-    def index_chapter(self, project_id: str, chapter_id: str, text: str):
-        if not text.strip(): return
-        # 过滤短句，保留有意义的段落
-        segments = [line.strip() for line in text.split('\n') if len(line.strip()) > 5]
-        if not segments: return
+    def migrate_legacy_collection(self, batch: int = MIGRATE_BATCH):
+        """
+        把共用集合里的记忆按 project_id 搬到各自的集合 (直接复制向量，不重新嵌入)。
+        每批搬完即从旧集合删除，中途中断后再次运行会从剩余部分继续。返回迁移条数。
+        """
+        # 旧版共用集合只可能在 Chroma 里
+        if not isinstance(self.store, ChromaStore): return 0
+        try:
+            legacy = self.store.client.get_collection(name=LEGACY_COLLECTION)
+        except Exception:
+            return 0
+        moved = 0
+        total = legacy.count()
+        if total: print(f"[RAG] 正在迁移旧版共用集合 ({total} 条) 到按项目分集合...")
+        while True:
+            data = legacy.get(limit=batch, include=["documents", "metadatas", "embeddings"])
+            if not data['ids']: break
+            groups = {}
+            for n, meta in enumerate(data['metadatas']):
+                groups.setdefault((meta or {}).get('project_id'), []).append(n)
+            for pid, rows in groups.items():
+                if pid:
+                    self._collection(pid).upsert(
+                        ids=[data['ids'][n] for n in rows], embeddings=[data['embeddings'][n] for n in rows],
+                        documents=[data['documents'][n] for n in rows], metadatas=[data['metadatas'][n] for n in rows]
+                    )
+            legacy.delete(ids=data['ids'])
+            moved += len(data['ids'])
+            print(f"[RAG] 迁移进度 {moved}/{total}")
+        self.store.delete_collection(LEGACY_COLLECTION)
+        if moved: print(f"[RAG] ✅ 迁移完成，共 {moved} 条")
+        return moved
+
+    @staticmethod
+    def _chunk_meta(project_id: str, chapter_id: str, chunk: dict, digest: str, order_index: int = None):
+        # line_start / line_end 对应章节分段的 seg_index，可回溯到原文；order_index 为章节先后，检索时按它剪枝防剧透
+        meta = {"project_id": project_id, "chapter_id": chapter_id, "line_index": chunk['line_start'],
+                "line_start": chunk['line_start'], "line_end": chunk['line_end'], "hash": digest}
+        if order_index is not None: meta["order_index"] = order_index
+        return meta
+
+    @staticmethod
+    def _order_filter(max_order: int = None):
+        return {"order_index": {"$lte": max_order}} if max_order is not None else None
+
+    def index_chapter(self, project_id: str, chapter_id: str, text: str, order_index: int = None):
+        """
+        增量索引：按块内容哈希与已有向量比对，只嵌入新增/变化的块，
+        块只是挪了位置时复用旧向量，多出来的旧 id 删除。order_index 变化 (或旧数据缺失) 的块同样复用向量改写 metadata。
+        """
+        chunks = self.chunker.chunk(text)
+        segments = [c['text'] for c in chunks]
+        col = self._collection(project_id)
+        try:
+            existing = col.get(where={"chapter_id": chapter_id}, include=["metadatas"])
+        except Exception as e:
+            print(f"[RAG Error] 读取章节索引失败: {e}")
+            existing = {'ids': [], 'metadatas': []}
+        old_hash = {i: (m or {}).get('hash') for i, m in zip(existing['ids'], existing['metadatas'])}
+        old_order = {i: (m or {}).get('order_index') for i, m in zip(existing['ids'], existing['metadatas'])}
+        hash_owner = {h: i for i, h in old_hash.items() if h}
 
-        # 生成唯一 ID
         ids = [f"{project_id}_{chapter_id}_{i}" for i in range(len(segments))]
-        metadatas = [{"project_id": project_id, "chapter_id": chapter_id, "line_index": i} for i in range(len(segments))]
-        
+        hashes = [seg_hash(seg) for seg in segments]
+        changed = [i for i in range(len(segments)) if old_hash.get(ids[i]) != hashes[i]
+                   or (order_index is not None and old_order.get(ids[i]) != order_index)]
+        # 段落只是移动 (前面插入/删除了段落)：同内容的旧向量直接搬过来
+        moved = [i for i in changed if hashes[i] in hash_owner]
+        fresh = [i for i in changed if hashes[i] not in hash_owner]
+        keep = set(ids)
+        orphans = [i for i in existing['ids'] if i not in keep]
+
+        def meta(i):
+            return self._chunk_meta(project_id, chapter_id, chunks[i], hashes[i], order_index)
+
         try:
-            self.collection.upsert(ids=ids, documents=segments, metadatas=metadatas)
-            print(f"[RAG] ✅ 已记忆章节 {chapter_id} ({len(segments)} 条)")
+            if moved:
+                src = col.get(ids=list({hash_owner[hashes[i]] for i in moved}), include=["embeddings"])
+                emb = dict(zip(src['ids'], src['embeddings']))
+                col.upsert(
+                    ids=[ids[i] for i in moved], embeddings=[emb[hash_owner[hashes[i]]] for i in moved],
+                    documents=[segments[i] for i in moved], metadatas=[meta(i) for i in moved]
+                )
+            if fresh:
+                col.upsert(
+                    ids=[ids[i] for i in fresh], documents=[segments[i] for i in fresh], metadatas=[meta(i) for i in fresh]
+                )
+            if orphans:
+                col.delete(ids=orphans)
+            if changed or orphans:
+                self._lexical_apply(project_id, [(ids[i], segments[i], meta(i)) for i in changed], orphans)
+                self.query_cache.invalidate(project_id)
+                print(f"[RAG] ✅ 已更新章节 {chapter_id}：新嵌入 {len(fresh)} 条，复用 {len(moved)} 条，删除 {len(orphans)} 条 (共 {len(segments)} 条)")
         except Exception as e:
             print(f"[RAG Error] 存储失败: {e}")
 
-    def search_context(self, query: str, project_id: str, n_results=5) -> str:
+    def _embed_and_upsert(self, col, rows, cancel: threading.Event = None):
+        """工作线程：rows 为 (id, document, metadata)，分批嵌入后一次写入"""
+        embeddings = []
+        for i in range(0, len(rows), EMBED_BATCH):
+            if cancel and cancel.is_set(): return 0
+            embeddings.extend(self.emb_fn([r[1] for r in rows[i:i + EMBED_BATCH]]))
+        col.upsert(
+            ids=[r[0] for r in rows], embeddings=embeddings,
+            documents=[r[1] for r in rows], metadatas=[r[2] for r in rows]
+        )
+        return len(rows)
+
+    async def index_project(self, project_id: str, chapters, total: int = 0, progress_callback=None, cancel: threading.Event = None):
+        """
+        整本书的首次向量化。chapters 为 (chapter_id, text, order_index) 的异步/同步可迭代对象，
+        多章的段落攒成大批次交给后台线程嵌入；读取下一批的同时上一批在嵌入。
+        progress_callback(msg, p) 在事件循环中调用；cancel 置位后尽快停止。返回写入条数。
+        """
+        loop = asyncio.get_running_loop()
+        col = self._collection(project_id)
+        rows, written, seen = [], 0, 0
+        inflight = None
+
+        async def drain():
+            nonlocal inflight, written
+            if inflight:
+                prev, inflight = inflight, None
+                written += await prev
+
+        async def submit(batch):
+            nonlocal inflight
+            await drain()
+            inflight = loop.run_in_executor(self.embed_executor, self._embed_and_upsert, col, batch, cancel)
+
+        async def chapter_stream():
+            if hasattr(chapters, '__aiter__'):
+                async for item in chapters: yield item
+            else:
+                for item in chapters: yield item
+
+        try:
+            try:
+                async for chapter_id, text, order_index in chapter_stream():
+                    if cancel and cancel.is_set(): break
+                    rows.extend(
+                        (f"{project_id}_{chapter_id}_{i}", c['text'], self._chunk_meta(project_id, chapter_id, c, seg_hash(c['text']), order_index))
+                        for i, c in enumerate(self.chunker.chunk(text))
+                    )
+                    seen += 1
+                    if len(rows) >= UPSERT_BATCH:
+                        await submit(rows); rows = []
+                        if progress_callback: progress_callback(f"正在向量化 ({seen}/{total or '?'} 章)...", seen / total if total else None)
+                if rows and not (cancel and cancel.is_set()): await submit(rows)
+            finally:
+                # 取消或出错时也要等正在执行的那批结束
+                await drain()
+                if written:
+                    self._order_checked.add(project_id)
+                    self._lexical_drop(project_id)
+                    self.query_cache.invalidate(project_id)
+        except Exception as e:
+            print(f"[RAG Error] 批量向量化失败: {e}")
+        state = "已取消" if cancel and cancel.is_set() else "完成"
+        print(f"[RAG] 批量向量化{state}：{seen} 章，{written} 条")
+        return written
+
+    # --- 混合检索 ---
+    def _lexical_index(self, project_id: str, col):
+        """取项目的 BM25 索引，未加载时从集合分页读取文本构建"""
+        with self._lexical_lock:
+            index = self._lexical.get(project_id)
+            if index is not None: return index
+            index = LexicalIndex()
+            offset = 0
+            while True:
+                data = col.get(limit=MIGRATE_BATCH, offset=offset, include=["documents", "metadatas"])
+                if not data['ids']: break
+                for doc_id, doc, meta in zip(data['ids'], data['documents'], data['metadatas']):
+                    index.add(doc_id, doc, meta)
+                offset += len(data['ids'])
+            self._lexical[project_id] = index
+            return index
+
+    def _lexical_apply(self, project_id: str, upserts, deletes):
+        with self._lexical_lock:
+            index = self._lexical.get(project_id)
+            if index is None: return
+            for doc_id in deletes: index.remove(doc_id)
+            for doc_id, doc, meta in upserts: index.add(doc_id, doc, meta)
+
+    def _lexical_drop(self, project_id: str):
+        with self._lexical_lock:
+            self._lexical.pop(project_id, None)
+
+    def _hybrid_search(self, col, project_id: str, query: str, vector_hits, n_results: int, max_order: int = None):
+        """
+        vector_hits: 向量检索的 (id, 文本) 候选 (已按 max_order 过滤)。与同范围的 BM25 候选按 RRF 融合，
+        再用 rapidfuzz 计算各关键词与候选的局部匹配度重排，返回前 n_results 条文本。
+        """
+        with self._lexical_lock:
+            index = self._lexical_index(project_id, col)
+            lexical_hits = index.search(query, CANDIDATE_POOL, max_order)
+            texts = {doc_id: index.docs[doc_id][0] for doc_id, _ in lexical_hits}
+        fused = {}
+        for rank, (doc_id, doc) in enumerate(vector_hits):
+            texts.setdefault(doc_id, doc)
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (RRF_K + rank + 1)
+        for rank, (doc_id, _) in enumerate(lexical_hits):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (RRF_K + rank + 1)
+        if not fused: return []
+        best = 2 / (RRF_K + 1)  # 两路都排第一时的融合分，用于归一化
+        terms = normalize_query(query).split()
+        def score(doc_id):
+            base = fused[doc_id] / best
+            if fuzz is None or not terms: return base
+            match = sum(fuzz.partial_ratio(t, texts[doc_id]) for t in terms) / (100 * len(terms))
+            return base + RERANK_WEIGHT * match
+        ranked = sorted(fused, key=score, reverse=True)[:n_results]
+        return [texts[doc_id] for doc_id in ranked]
+
+    def _format_context(self, docs) -> str:
+        if not docs: return ""
+        context_text = "\n".join([f"- {doc}" for doc in docs])
+        print(f"[RAG] 🧠 联想到了 {len(docs)} 条相关记忆")
+        return f"【前文剧情/相关记忆 (RAG)】：\n{context_text}\n"
+
+    def search_context(self, query: str, project_id: str, n_results=DEFAULT_RESULTS, max_order: int = None) -> str:
+        return self.search_many([query], project_id, n_results, max_order)[0]
+
+    def search_many(self, queries, project_id: str, n_results=DEFAULT_RESULTS, max_order: int = None):
+        """
+        多组关键词一次检索：缓存未命中的查询合并成一次 Chroma query (一次批量嵌入)，
+        返回与 queries 一一对应的上下文文本。
+        max_order 给定时只检索 order_index 不超过它的章节 (写第 N 章时不会读到后文剧透)，
+        过滤条件下推到向量检索与 BM25 内部，前面章节越少候选集越小。
+        """
+        results = [None] * len(queries)
+        pending = {}  # 归一化查询 -> 下标列表 (重复查询只算一次)
+        for i, query in enumerate(queries):
+            cached = self.query_cache.get(project_id, query, n_results, max_order)
+            if cached is not None: results[i] = cached
+            else: pending.setdefault(normalize_query(query), []).append(i)
+        if not pending: return results
+        generation = self.query_cache.generation(project_id)
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results,
-                where={"project_id": project_id} # 严格隔离
-            )
-            if not results['documents'] or not results['documents'][0]: return ""
-            
-            retrieved_docs = results['documents'][0]
-            context_text = "\n".join([f"- {doc}" for doc in retrieved_docs])
-            print(f"[RAG] 🧠 联想到了 {len(retrieved_docs)} 条相关记忆")
-            return f"【前文剧情/相关记忆 (RAG)】：\n{context_text}\n"
+            col = self._collection(project_id, create=False)
+            count = col.count() if col else 0
+            if not count:
+                for rows in pending.values():
+                    for i in rows: results[i] = ""
+                    self.query_cache.put(project_id, queries[rows[0]], n_results, "", generation, max_order)
+                return results
+            batch = [queries[rows[0]] for rows in pending.values()]
+            # 集合本身就是按项目隔离的，无需 where 过滤 (两种后端的 query 返回格式一致)
+            found = col.query(query_texts=batch, n_results=min(CANDIDATE_POOL, count), where=self._order_filter(max_order))
+            for j, (query, rows) in enumerate(zip(batch, pending.values())):
+                vector_hits = list(zip(found['ids'][j], found['documents'][j]))
+                result = self._format_context(self._hybrid_search(col, project_id, query, vector_hits, n_results, max_order))
+                self.query_cache.put(project_id, query, n_results, result, generation, max_order)
+                for i in rows: results[i] = result
         except Exception as e:
             print(f"[RAG Error] 搜索失败: {e}")
-            return ""
+        return [r if r is not None else "" for r in results]
+
+    def cache_stats(self) -> dict:
+        """缓存命中统计：{'query': 检索结果缓存, 'embedding': 嵌入缓存}"""
+        return {'query': self.query_cache.stats(), 'embedding': self.emb_fn.stats()}
+
+    # --- 异步接口：阻塞调用放到有界线程池，事件循环只等待结果 ---
+    async def asearch_context(self, query: str, project_id: str, n_results=DEFAULT_RESULTS, max_order: int = None) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.query_executor, self.search_context, query, project_id, n_results, max_order)
+
+    async def asearch_many(self, queries, project_id: str, n_results=DEFAULT_RESULTS, max_order: int = None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.query_executor, self.search_many, list(queries), project_id, n_results, max_order)
+
+    async def aindex_chapter(self, project_id: str, chapter_id: str, text: str, order_index: int = None):
+        """与批量向量化共用写线程，同一章节的写入按提交顺序执行"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.embed_executor, self.index_chapter, project_id, chapter_id, text, order_index)
+
+    def backfill_order_index(self, project_id: str, orders: dict):
+        """
+        旧版记忆没有 order_index，按章节过滤时会被整条排除：分页检查 metadata，
+        缺失或与 orders ({章节 id: order_index}) 不一致的只改 metadata，不重新嵌入。返回改写条数。
+        """
+        if project_id in self._order_checked: return 0
+        col = self._collection(project_id, create=False)
+        fixed = 0
+        if col is not None:
+            try:
+                for data in self.iter_project_memory(project_id, include=("metadatas",)):
+                    ids, metas = [], []
+                    for doc_id, meta in zip(data['ids'], data['metadatas']):
+                        order = orders.get((meta or {}).get('chapter_id'))
+                        if order is not None and (meta or {}).get('order_index') != order:
+                            ids.append(doc_id); metas.append({**meta, 'order_index': order})
+                    if ids:
+                        col.update(ids=ids, metadatas=metas)
+                        fixed += len(ids)
+            except Exception as e:
+                print(f"[RAG Error] 补齐章节序号失败: {e}")
+                return fixed
+            if fixed:
+                self._lexical_drop(project_id)
+                self.query_cache.invalidate(project_id)
+                print(f"[RAG] 已为项目 {project_id} 的 {fixed} 条记忆补齐章节序号")
+        self._order_checked.add(project_id)
+        return fixed
+
+    async def abackfill_order_index(self, project_id: str, orders: dict):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.bulk_executor, self.backfill_order_index, project_id, orders)
 
     def delete_project_memory(self, project_id: str):
         try:
-            self.collection.delete(where={"project_id": project_id})
+            with self._collections_lock:
+                self._collections.pop(project_id, None)
+                self._order_checked.discard(project_id)
+                self._lexical_drop(project_id)
+                self.store.delete_collection(self.collection_name(project_id))
+            self.query_cache.invalidate(project_id)
             print(f"[RAG] 已清除项目 {project_id} 的记忆")
         except Exception as e:
             print(f"[RAG Error] 删除失败: {e}")
 
-    # --- 新增：记忆克隆 (用于副本创建) ---
-    def clone_project_memory(self, old_pid: str, new_pid: str):
+    # --- 记忆导出 / 克隆 (用于副本创建) ---
+    def iter_project_memory(self, project_id: str, page: int = CLONE_PAGE, include=("documents", "metadatas", "embeddings")):
+        """按页产出项目的记忆 {'ids', 'documents', 'metadatas', 'embeddings'}，同一时间只有一页在内存里"""
+        col = self._collection(project_id, create=False)
+        if col is None: return
+        offset = 0
+        while True:
+            data = col.get(limit=page, offset=offset, include=list(include))
+            if not data['ids']: return
+            yield data
+            offset += len(data['ids'])
+
+    def clone_project_memory(self, old_pid: str, new_pid: str, chapter_map=None, progress_callback=None, cancel: threading.Event = None):
         """
-        将旧项目的所有记忆复制一份给新项目，实现记忆隔离与演变
+        分页把旧项目的记忆复制给新项目 (直接复用向量，不重新嵌入)。
+        chapter_map: {旧章节 id: 新章节 id}，用于改写 metadata 与向量 id，副本保存时的增量索引才能对上号。
+        目标里已存在的 id 跳过 (副本在克隆期间被编辑保存过，以新内容为准)。
+        progress_callback(done, total) 在工作线程中调用。返回复制条数。
         """
         print(f"[RAG] 正在克隆记忆: {old_pid} -> {new_pid} ...")
+        chapter_map = chapter_map or {}
+        copied = 0
         try:
-            # 1. 获取旧项目的所有数据
-            # ChromaDB 的 get 方法可以获取所有匹配的 embedding 和 metadata
-            existing_data = self.collection.get(where={"project_id": old_pid}, include=["documents", "metadatas", "embeddings"])
-            
-            if not existing_data['ids']:
+            src = self._collection(old_pid, create=False)
+            total = src.count() if src else 0
+            if not total:
                 print("[RAG] 原项目无记忆，跳过克隆")
-                return
-
-            count = len(existing_data['ids'])
-            
-            # 2. 构建新数据
-            new_ids = []
-            new_metadatas = []
-            new_documents = existing_data['documents']
-            new_embeddings = existing_data['embeddings']
-
-            for i in range(count):
-                # 生成新的唯一 ID，但保持原来的章节结构逻辑
-                # 原 ID 格式: {old_pid}_{chapter_id}_{index}
-                # 我们只需要替换 ID 前缀，或者干脆生成全新的 UUID 防止冲突
-                # 为了简单且安全，我们使用 UUID
-                new_ids.append(str(uuid.uuid4()))
-                
-                # 复制元数据，但修改 project_id
-                meta = existing_data['metadatas'][i].copy()
-                meta['project_id'] = new_pid
-                new_metadatas.append(meta)
-
-            # 3. 批量插入 (Chroma 建议分批插入，防止一次太大)
-            batch_size = 500
-            for i in range(0, count, batch_size):
-                end = min(i + batch_size, count)
-                self.collection.upsert(
-                    ids=new_ids[i:end],
-                    embeddings=new_embeddings[i:end], # 直接复用向量，省去重新计算的时间！
-                    documents=new_documents[i:end],
-                    metadatas=new_metadatas[i:end]
-                )
-            
-            print(f"[RAG] ✅ 记忆克隆完成，共复制 {count} 条。新项目 ({new_pid}) 拥有了独立的记忆空间。")
-            
+                return 0
+            dst = self._collection(new_pid)
+            for data in self.iter_project_memory(old_pid):
+                if cancel and cancel.is_set(): break
+                ids, metas = [], []
+                for old_id, meta in zip(data['ids'], data['metadatas']):
+                    meta = dict(meta or {})
+                    old_cid = meta.get('chapter_id')
+                    new_cid = chapter_map.get(old_cid, old_cid)
+                    prefix = f"{old_pid}_{old_cid}_"
+                    # 旧版克隆产生的 uuid id 无法还原块序号，重新生成
+                    ids.append(f"{new_pid}_{new_cid}_{old_id[len(prefix):]}" if old_id.startswith(prefix) else str(uuid.uuid4()))
+                    meta['project_id'] = new_pid
+                    meta['chapter_id'] = new_cid
+                    metas.append(meta)
+                present = set(dst.get(ids=ids, include=[])['ids'])
+                keep = [n for n, i in enumerate(ids) if i not in present]
+                if keep:
+                    dst.upsert(
+                        ids=[ids[n] for n in keep],
+                        embeddings=[data['embeddings'][n] for n in keep], # 直接复用向量，省去重新计算的时间！
+                        documents=[data['documents'][n] for n in keep],
+                        metadatas=[metas[n] for n in keep]
+                    )
+                copied += len(data['ids'])
+                if progress_callback: progress_callback(copied, total)
+            print(f"[RAG] ✅ 记忆克隆{'已取消' if cancel and cancel.is_set() else '完成'}，共复制 {copied}/{total} 条。")
         except Exception as e:
             print(f"[RAG Error] 克隆失败: {e}")
+        finally:
+            self._lexical_drop(new_pid)
+            self.query_cache.invalidate(new_pid)
+        return copied
+
+    async def aclone_project_memory(self, old_pid: str, new_pid: str, chapter_map=None, progress_callback=None, cancel: threading.Event = None):
+        """在后台线程克隆；progress_callback(done, total) 转回事件循环调用"""
+        loop = asyncio.get_running_loop()
+        report = None
+        if progress_callback:
+            report = lambda done, total: loop.call_soon_threadsafe(progress_callback, done, total)
+        return await loop.run_in_executor(self.bulk_executor, self.clone_project_memory, old_pid, new_pid, chapter_map, report, cancel)
 
 if __name__ == "__main__":
-    # 测试代码
-    rag = RAGEngine()
\ No newline at end of file
+    # 迁移工具：python -m src.ai.rag_engine (初始化时自动把旧共用集合拆分到各项目集合)
+    rag = RAGEngine()
+    for name in rag.store.list_collections():
+        if name.startswith(COLLECTION_PREFIX):
+            print(f"  {name}: {rag.store.get_collection(name, create=False).count()} 条")
\ No newline at end of file
@@ -0,0 +1,179 @@
+import math
+import re
+
+# 单个组合正则，一次 match 同时判定所有“强”标题样式
+HEADING_RE = re.compile(
+    r'^\s*(?:'
+    r'(?P<cn>[【\[]?\s*第\s*(?P<cn_num>[0-9零一二三四五六七八九十百千万两〇]+)\s*(?P<cn_unit>[章卷回节集部篇]))'
+    r'|(?P<en>(?:Chapter|CHAPTER|chapter)\s*(?P<en_num>\d+)|(?:Vol|VOL)\.?\s*(?P<vol_num>\d+))'
+    r'|(?P<num>(?P<num_num>\d+)\.\s+.{0,30}$)'
+    r'|(?P<bracket>[【\[]\s*.*?\s*[】\]])'
+    r')'
+)
+# 宽松样式：短行且不以标点结尾
+SHORT_END_PUNCT = tuple('。，？！…：”』」,.?!:;；')
+
+# 各样式先验权重
+STYLE_PRIOR = {'numbered': 1.0, 'cn': 1.0, 'en': 0.95, 'num': 0.8, 'bracket': 0.6, 'short': 0.2}
+# 可合并为同一编号序列的样式 (如 第1章 / Chapter 2 / 3. 混排)
+NUMBERED_STYLES = ('cn', 'en', 'num')
+VOLUME_UNITS = ('卷', '部', '集', '篇')
+MIN_HEADINGS = 3
+# 低于此分数不切分 (整本作为“全文”)，防止宽松样式在对白密集的文本上误切
+MIN_SCORE = 0.1
+# 标题间中位字数低于此值时视为“过密” (多半是对白短句而非章节)
+DENSE_GAP = 1000
+
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100, '千': 1000, '万': 10000}
+
+def cn_to_int(text: str):
+    """中文/阿拉伯数字转整数，无法解析返回 None"""
+    if text.isdigit(): return int(text)
+    total, section, digit = 0, 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+        elif ch in _CN_UNITS:
+            unit = _CN_UNITS[ch]
+            if unit == 10000:
+                total += (section + digit) * unit; section = 0
+            else:
+                section += (digit or 1) * unit
+            digit = 0
+        else:
+            return None
+    return total + section + digit
+
+class ChapterDetector:
+    """
+    单遍章节标题检测：逐行喂入，每行只跑一次组合正则。
+    扫描结束后为每种标题样式 (及编号样式的混排组合) 打分，选出最一致的切分。
+    """
+    def __init__(self):
+        self.candidates = {style: [] for style in ('cn', 'en', 'num', 'bracket', 'short')}
+        self.offset = 0
+
+    def feed(self, line_no: int, line: str):
+        offset = self.offset
+        self.offset += len(line) + 1
+        stripped = line.strip()
+        if not stripped: return
+        m = HEADING_RE.match(line)
+        if m:
+            style = self._outer_group(m)
+            self.candidates[style].append((line_no, offset, self._number(m, style)))
+        elif 2 <= len(stripped) <= 20 and not stripped.endswith(SHORT_END_PUNCT):
+            self.candidates['short'].append((line_no, offset, None))
+
+    def _outer_group(self, m):
+        for style in ('cn', 'en', 'num', 'bracket'):
+            if m.group(style) is not None: return style
+        return 'short'
+
+    def _number(self, m, style):
+        """返回章节序号；卷/部等分卷标题返回 0 表示序号重置"""
+        if style == 'cn':
+            if m.group('cn_unit') in VOLUME_UNITS: return 0
+            return cn_to_int(m.group('cn_num'))
+        if style == 'en':
+            return int(m.group('en_num')) if m.group('en_num') else 0
+        if style == 'num':
+            return int(m.group('num_num'))
+        return None
+
+    def _score(self, style, cands):
+        if len(cands) < MIN_HEADINGS: return 0.0
+        # 1. 序号连续性：相邻序号 +1 (或分卷后重置) 的比例
+        nums = [c[2] for c in cands if c[2] is not None]
+        if len(nums) >= 2:
+            ok = sum(1 for a, b in zip(nums, nums[1:]) if b == a + 1 or b == 0 or a == 0 or (b == 1 and a > 1))
+            seq = ok / (len(nums) - 1)
+            evidence = seq * len(nums) / len(cands)
+        else:
+            seq, evidence = 0.5, 0.0
+        # 2. 密度：章节正文过短说明误把普通短句当成了标题；序号越连续，越不依赖这一项
+        gaps = sorted(b[1] - a[1] for a, b in zip(cands, cands[1:]))
+        median = gaps[len(gaps) // 2]
+        density = 1.0 if median >= DENSE_GAP else max(median / DENSE_GAP, 0.01)
+        if evidence < 0.5 and density < 0.25: return 0.0  # 过密且无序号佐证，直接淘汰
+        return STYLE_PRIOR[style] * (0.5 + seq) * density ** (1 - evidence) * math.log(len(cands))
+
+    def scores(self):
+        scored = {style: self._score(style, c) for style, c in self.candidates.items()}
+        merged = sorted(c for style in NUMBERED_STYLES for c in self.candidates[style])
+        scored['numbered'] = self._score('numbered', merged)
+        return scored
+
+    def detect(self):
+        """返回 (样式名, 标题行号列表)；无可信标题时返回 (None, [])"""
+        scored = self.scores()
+        style = max(scored, key=scored.get)
+        if scored[style] < MIN_SCORE: return None, []
+        if style == 'numbered':
+            cands = sorted(c for s in NUMBERED_STYLES for c in self.candidates[s])
+        else:
+            cands = self.candidates[style]
+        return style, [c[0] for c in cands]
+
+# ==========================
+# Benchmark: python -m src.core.chapter_manager [MB ...]
+# ==========================
+LEGACY_PATTERNS = [
+    r'(?m)^\s*(?:第[0-9零一二三四五六七八九十百千]+[章卷]|Chapter\s*\d+|Vol\.\d+).*?$',
+    r'(?m)^\s*\d+\.\s+.{0,30}$',
+    r'(?m)^\s*[【\[]\s*.*?\s*[】\]].*?$',
+    r'(?m)^\s*(?!.*[。，？！……：]$).{2,20}\s*$'
+]
+
+def _int_to_cn(n: int) -> str:
+    digits = '零一二三四五六七八九'
+    if n < 10: return digits[n]
+    if n < 100: return (digits[n // 10] if n >= 20 else '') + '十' + (digits[n % 10] if n % 10 else '')
+    return str(n)
+
+def _synthetic_novel(size_mb: float, seed: int = 0, headings: bool = True):
+    """
+    生成混排标题 (第N章 / Chapter N / 【第N章】) 的合成小说，返回 (文本, 真实章节数)。
+    headings=False 时不含标题，对应旧级联逐个回退的最坏情况。
+    """
+    import random
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024 / 3)  # 中文约 3 字节/字
+    para = ["他抬头看了一眼天空，沉默良久。", "“走吧。”她说。", "风从山谷里吹来，带着潮湿的泥土味道，远处传来几声犬吠。", "好。", "夜色渐深"]
+    parts, size, n = ["这是前言。\n"], 0, 0
+    while size < target:
+        n += 1
+        style = rng.random()
+        if not headings: head = ""
+        elif style < 0.6: head = f"第{_int_to_cn(n)}章 风起"
+        elif style < 0.85: head = f"Chapter {n} The Wind"
+        else: head = f"【第{n}章】 夜行"
+        body = "\n".join(rng.choice(para) for _ in range(rng.randint(40, 120)))
+        chunk = f"\n{head}\n{body}\n"
+        parts.append(chunk); size += len(chunk)
+    return "".join(parts), n
+
+def benchmark(sizes=(10, 50)):
+    import time
+    cases = [(mb, headings) for mb in sizes for headings in (True, False)]
+    for mb, headings in cases:
+        text, truth = _synthetic_novel(mb, headings=headings)
+        if not headings: truth = 0
+        t0 = time.perf_counter()
+        legacy = []
+        for p in LEGACY_PATTERNS:
+            legacy = list(re.finditer(p, text))
+            if len(legacy) > 2: break
+        t1 = time.perf_counter()
+        det = ChapterDetector()
+        for i, line in enumerate(text.split('\n')): det.feed(i, line)
+        style, heads = det.detect()
+        t2 = time.perf_counter()
+        print(f"[Bench] {mb}MB {'混排标题' if headings else '无标题'}，真实章节 {truth}")
+        print(f"  legacy cascade : {t1 - t0:6.2f}s  切分 {len(legacy)}")
+        print(f"  ChapterDetector: {t2 - t1:6.2f}s  切分 {len(heads)} ({style})")
+
+if __name__ == "__main__":
+    import sys
+    benchmark([float(a) for a in sys.argv[1:]] or (10, 50))
@@ -0,0 +1,80 @@
+import asyncio
+import aiosqlite
+from contextlib import asynccontextmanager
+
+# 连接池参数
+READER_COUNT = 4
+STATEMENT_CACHE = 256  # sqlite3 内置的预编译语句缓存 (按 SQL 文本复用)
+
+class DBPool:
+    """
+    长连接池：N 个只读连接 + 1 个写连接。
+    WAL 模式下读写互不阻塞，UI 读取章节时批量任务可以同时写入。
+    """
+    def __init__(self, db_path: str, readers: int = READER_COUNT):
+        self.db_path = db_path
+        self.reader_count = readers
+        self._readers = None
+        self._all_readers = []
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def _connect(self, readonly=False):
+        db = await aiosqlite.connect(self.db_path, cached_statements=STATEMENT_CACHE)
+        db.row_factory = aiosqlite.Row
+        await db.execute("PRAGMA busy_timeout = 5000")
+        await db.execute("PRAGMA foreign_keys = ON")
+        if readonly:
+            await db.execute("PRAGMA query_only = ON")
+        else:
+            await db.execute("PRAGMA journal_mode = WAL")
+            await db.execute("PRAGMA synchronous = NORMAL")
+        return db
+
+    async def open(self):
+        async with self._open_lock:
+            if self.is_open: return
+            # 写连接先开，保证 WAL 在读连接之前生效
+            self._writer = await self._connect()
+            self._readers = asyncio.Queue()
+            for _ in range(self.reader_count):
+                db = await self._connect(readonly=True)
+                self._all_readers.append(db)
+                self._readers.put_nowait(db)
+            print(f"[DB] 连接池已就绪 (WAL, {self.reader_count} 读 / 1 写)")
+
+    async def close(self):
+        async with self._open_lock:
+            if not self.is_open: return
+            for db in self._all_readers:
+                await db.close()
+            self._all_readers = []
+            self._readers = None
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self):
+        if not self.is_open: await self.open()
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def write(self):
+        """单写者事务：正常退出提交，异常回滚"""
+        if not self.is_open: await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
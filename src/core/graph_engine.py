@@ -2,8 +2,8 @@ import networkx as nx
 import json
 import os
 import re
-import asyncio
 from src.ai.llm_client import LLMClient
+from src.ai.llm_scheduler import PRIORITY_BACKGROUND
 from src.utils.logger import ConsoleLogger as Log
 
 class GraphEngine:
@@ -58,22 +58,24 @@ class GraphEngine:
         links = [{"source": u, "target": v, "value": data.get('relation', ''), "lineStyle": {"width": 2 if data.get('is_secret') else 1}} for u, v, data in self.graph.edges(data=True)]
         return {"nodes": nodes, "links": links}
 
-    def query_context(self, entity: str, current_chapter: int, mode: str = 'reader') -> str:
+    def query_context(self, entity: str, current_order: int = None, mode: str = 'reader') -> str:
+        """current_order 为当前章节的 order_index (与 RAG 记忆同一套顺序)，None 表示不限"""
         if entity not in self.graph: return ""
         lines = []
         for neighbor in self.graph.successors(entity):
             edges = self.graph[entity][neighbor]
             for _, data in edges.items():
-                if self._check_visibility(data, current_chapter, mode):
+                if self._check_visibility(data, current_order, mode):
                     info = f"- {entity} {data.get('relation')} {neighbor}"
                     if data.get('desc'): info += f" ({data.get('desc')})"
                     if mode == 'author' and data.get('is_secret'): info += " [🔒伏笔]"
                     lines.append(info)
         return "\n".join(lines)
 
-    def _check_visibility(self, edge_data, current_chapter, mode):
-        if mode == 'author': return True
-        if current_chapter < edge_data.get('reveal_chapter', 0): return False
+    def _check_visibility(self, edge_data, current_order, mode):
+        if mode == 'author' or current_order is None: return True
+        reveal = edge_data.get('reveal_chapter')
+        if reveal is not None and current_order < reveal: return False
         return True
 
     async def build_graph_from_chapters(self, chapters, status_callback=None, config=None):
@@ -85,15 +87,16 @@ class GraphEngine:
             if len(txt) < 50: continue
             if status_callback: status_callback(f"分析第 {i+1}/{total} 章...", (i / total))
             
-            await self.extract_from_text_stream(txt, i+1, mgr.rag, config)
+            await self.extract_from_text_stream(txt, chapter.get('order_index', i), await mgr.rag.aget(), config)
             
+            # 限速交给 LLM 调度器 (后台优先级，不会挤占交互请求)
             if i % 3 == 0: self.save_graph()
-            await asyncio.sleep(0.5)
 
         self.save_graph()
         if status_callback: status_callback("完成", 1.0)
 
     async def extract_from_text_stream(self, text: str, chapter_index: int, rag_engine=None, config=None):
+        """chapter_index 为章节 order_index：消歧只参考该章及之前的记忆，提取的关系从该章起可见"""
         if not config:
             Log.system("GraphEngine: 无配置 (No Config)")
             return
@@ -101,7 +104,7 @@ class GraphEngine:
         rag_context = ""
         if rag_engine and len(text) > 200:
             query = text[:100] + " " + text[-100:]
-            rag_context = rag_engine.search_context(query, self.project_id, n_results=3)
+            rag_context = await rag_engine.asearch_context(query, self.project_id, n_results=3, max_order=chapter_index)
             if rag_context:
                 rag_context = f"【参考资料】\n{rag_context}\n请参考此资料进行消歧。"
 
@@ -121,7 +124,7 @@ class GraphEngine:
         
         try:
             json_str = ""
-            async for token in self.llm.stream_rewrite(text, prompt, ext_conf):
+            async for token in self.llm.stream_rewrite(text, prompt, ext_conf, priority=PRIORITY_BACKGROUND):
                 json_str += token
             
             # === 调试日志：看看 AI 到底回了什么 ===
@@ -0,0 +1,191 @@
+import asyncio
+import codecs
+import io
+import tempfile
+
+# 每次解码 / 处理的块大小
+CHUNK_SIZE = 1024 * 1024
+# 每多少行让出一次事件循环，避免大文件导入卡住 UI
+YIELD_EVERY = 20000
+# 编码探测：从文件头/中/尾各取一段样本
+SAMPLE_SIZE = 64 * 1024
+# 无 BOM 时的候选编码，得分相同按顺序优先
+CANDIDATE_ENCODINGS = ('utf-8', 'gb18030', 'big5')
+# 无 BOM 且几乎没有零字节的 UTF-16 (纯中文正文)，只在样本不是合法 UTF-8 时参与打分
+UTF16_ENCODINGS = ('utf-16-le', 'utf-16-be')
+# 简繁共用的高频汉字，用于区分 GB18030 / Big5 的“能解码但是乱码”
+COMMON_HANZI = frozenset(
+    "的一是不了人我在有他这中大来上个到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后小么心多天而能好都然没日于起还"
+    "发成事只作当想看无开手十用主行方又如前所本见经头面同三已老从动两长知样现分外但身些与高意进把法此实回二理美点月明其种声全工己话儿者"
+    "向情部正名定女问力机给等几很最间新什打便位因重被走四第门相次东海口使西再平真听世气信北少关并内加化由却代军产入先山五太水万市眼体"
+    "别处总才场师书比住九笑性目立马命张活难神数件安表原车白应路期叫死常提感金何更反合放做系计或司利受光王果亲界及今京务制解各任至清物"
+)
+
+def iter_text_chunks(source, encoding='utf-8', chunk_size=CHUNK_SIZE, counter=None):
+    """
+    把 str / bytes / 文件对象 / 块迭代器统一成文本块流。
+    bytes 走增量解码器，不会生成整份解码后的副本。
+    counter: 可选 dict，'read' 累计已消费的原始长度 (供进度条使用)
+    """
+    if counter is None: counter = {}
+    counter.setdefault('read', 0)
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    if isinstance(source, str):
+        for i in range(0, len(source), chunk_size):
+            counter['read'] += min(chunk_size, len(source) - i)
+            yield source[i:i + chunk_size]
+        return
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for i in range(0, len(view), chunk_size):
+            piece = view[i:i + chunk_size]
+            counter['read'] += len(piece)
+            yield decoder.decode(piece)
+        yield decoder.decode(b'', final=True)
+        return
+    if hasattr(source, 'read'):
+        reader = source
+        source = iter(lambda: reader.read(chunk_size), reader.read(0))
+    for chunk in source:
+        counter['read'] += len(chunk)
+        if isinstance(chunk, str): yield chunk
+        else: yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+def iter_clean_lines(chunks):
+    """流式版 _clean_text + split('\\n')：统一换行与空白字符，逐行产出"""
+    carry = ""
+    for chunk in chunks:
+        if not chunk: continue
+        buf = carry + chunk
+        # \r\n 可能被切在两个块之间，先留到下一块
+        if buf.endswith('\r'):
+            buf, tail = buf[:-1], '\r'
+        else:
+            tail = ''
+        buf = buf.replace("\xa0", " ").replace("\u3000", " ").replace("\r\n", "\n").replace("\r", "\n")
+        lines = buf.split('\n')
+        carry = lines.pop() + tail
+        yield from lines
+    if carry:
+        yield from carry.replace("\xa0", " ").replace("\u3000", " ").replace("\r", "\n").split('\n')
+
+def _read_samples(f):
+    """从可 seek 的二进制文件头/中/尾取样，读完恢复原位置"""
+    pos = f.tell()
+    try:
+        f.seek(0, 2); size = f.tell() - pos
+        offsets = [pos] if size <= SAMPLE_SIZE * 3 else [pos, pos + size // 2, pos + size - SAMPLE_SIZE]
+        samples = []
+        for off in offsets:
+            f.seek(off - off % 2)  # 对齐到偶数字节，方便 UTF-16 判断
+            samples.append(f.read(SAMPLE_SIZE))
+        return samples
+    finally:
+        f.seek(pos)
+
+def _decode_samples(samples, encoding):
+    """逐个样本产出 (文本, 错误数)；中/尾样本的首尾可能截断半个字符，各容忍一处错误"""
+    for i, sample in enumerate(samples):
+        text = sample.decode(encoding, 'replace')
+        yield text, max(text.count('\ufffd') - (0 if i == 0 else 2), 0)
+
+def _score_encoding(samples, encoding):
+    """解码错误扣分，高频汉字加分"""
+    return sum(sum(1 for ch in text if ch in COMMON_HANZI) - 50 * errors for text, errors in _decode_samples(samples, encoding))
+
+def detect_encoding(source) -> str:
+    """
+    采样探测编码：BOM → UTF-16 (无 BOM 时看零字节分布) → UTF-8 / GB18030 / Big5 (/ UTF-16) 打分。
+    source 为 bytes 或可 seek 的二进制文件；无法采样时返回 'utf-8'。
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        samples = _read_samples(io.BytesIO(source))
+    elif hasattr(source, 'read') and hasattr(source, 'seek'):
+        try: samples = _read_samples(source)
+        except (OSError, ValueError): return 'utf-8'
+        if samples and isinstance(samples[0], str): return 'utf-8'
+    else:
+        return 'utf-8'
+    head = samples[0] if samples else b''
+    if head.startswith(codecs.BOM_UTF8): return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)): return 'utf-16'
+    # 中文 UTF-16 也含大量 ASCII 标点/换行，零字节集中在奇数位 (LE) 或偶数位 (BE)
+    if len(head) >= 64:
+        even, odd = head[0::2].count(0), head[1::2].count(0)
+        if odd > len(head) * 0.1 and even < odd / 10: return 'utf-16-le'
+        if even > len(head) * 0.1 and odd < even / 10: return 'utf-16-be'
+    # 英文等合法 UTF-8 按 UTF-16 解码也会凑巧撞上常用字，所以 UTF-8 能解码时不考虑 UTF-16
+    candidates = CANDIDATE_ENCODINGS
+    if any(errors for _, errors in _decode_samples(samples, 'utf-8')): candidates += UTF16_ENCODINGS
+    scores = {enc: _score_encoding(samples, enc) for enc in candidates}
+    return max(candidates, key=lambda enc: scores[enc])
+
+async def spool_upload(file_obj):
+    """
+    把上传文件按块落盘，返回 (二进制文件对象, 是否为新建的临时文件)。
+    已经是可 seek 的同步文件 (如 SpooledTemporaryFile) 时直接复用，不再复制。
+    """
+    if file_obj is None: return None, False
+    if isinstance(file_obj, (bytes, bytearray)):
+        spool = tempfile.TemporaryFile()
+        spool.write(file_obj); spool.seek(0)
+        return spool, True
+    read = getattr(file_obj, 'read', None)
+    if read is not None and not asyncio.iscoroutinefunction(read) and hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+        return file_obj, False
+    spool = tempfile.TemporaryFile()
+    try:
+        if hasattr(file_obj, 'iterate'):
+            async for chunk in file_obj.iterate(): spool.write(chunk)
+        elif read is not None:
+            while True:
+                try: chunk = read(CHUNK_SIZE)
+                except TypeError: chunk = read()  # 不支持分块读取的上传对象
+                if asyncio.iscoroutine(chunk): chunk = await chunk
+                if not chunk: break
+                spool.write(chunk)
+                if len(chunk) < CHUNK_SIZE: break
+        elif hasattr(file_obj, '_data'):
+            spool.write(file_obj._data)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, True
+
+def source_size(source):
+    """估算输入大小，用于进度条；未知时返回 0"""
+    if isinstance(source, (str, bytes, bytearray, memoryview)): return len(source)
+    if hasattr(source, 'seek') and hasattr(source, 'tell'):
+        try:
+            pos = source.tell(); source.seek(0, 2); size = source.tell(); source.seek(pos)
+            return size - pos
+        except (OSError, ValueError): pass
+    return 0
+
+async def spool_and_scan(source, detector, encoding=None, progress_callback=None):
+    """
+    单遍扫描：一边把清洗后的行写入磁盘临时文件，一边把每行喂给章节检测器。
+    encoding 为 None 时对 bytes / 二进制文件采样探测。
+    返回 spool 文件 (已 seek 到开头)，调用方负责关闭。
+    """
+    if encoding is None:
+        encoding = detect_encoding(source)
+        print(f"[Import] 检测到编码: {encoding}")
+    total = source_size(source) or 1
+    counter = {'read': 0}
+    spool = tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='\n')
+    try:
+        for line_no, line in enumerate(iter_clean_lines(iter_text_chunks(source, encoding, counter=counter))):
+            spool.write(line); spool.write('\n')
+            detector.feed(line_no, line)
+            if line_no % YIELD_EVERY == 0:
+                if progress_callback: progress_callback("正在扫描章节...", min(counter['read'] / total, 1.0) * 0.5)
+                await asyncio.sleep(0)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
@@ -1,12 +1,83 @@
+import asyncio
+import importlib
+import threading
 from src.core.project_manager import ProjectManager
-from src.ai.llm_client import LLMClient
-from src.core.tavern_parser import TavernParser
-from src.ai.rag_engine import RAGEngine
-# 容错导入 GraphEngine
-try:
-    from src.core.graph_engine import GraphEngine
-except ImportError:
-    GraphEngine = None 
+from src.utils.startup import startup_mark, timed
+
+class LazyEngine:
+    """
+    重量级子系统 (Chroma + 嵌入模型、langchain SDK、PIL) 的惰性代理：
+    首次访问属性时才构建；启动后由 warm_up 在后台线程提前构建，用户一般感知不到。
+    协程里请用 aget()：预热未完成时构建 (或等待预热线程) 放在线程里，不卡事件循环。
+    """
+    def __init__(self, name: str, factory):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    with timed(self._name):
+                        self._instance = self._factory()
+        return self._instance
+
+    async def aget(self):
+        return self._instance or await asyncio.to_thread(self.get)
+
+    @property
+    def ready(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, item):
+        return getattr(self.get(), item)
+
+    def __bool__(self):
+        return True
+
+class LazyClass:
+    """按需导入的类；导入失败时为假值 (替代原先的容错导入)"""
+    def __init__(self, module: str, name: str):
+        self._module = module
+        self._name = name
+        self._cls = None
+        self._failed = False
+
+    def load(self):
+        if self._cls is None and not self._failed:
+            try:
+                with timed(self._name):
+                    self._cls = getattr(importlib.import_module(self._module), self._name)
+            except ImportError as e:
+                print(f"{self._name} module not found: {e}")
+                self._failed = True
+        return self._cls
+
+    def __bool__(self):
+        return self.load() is not None
+
+    def __call__(self, *args, **kwargs):
+        cls = self.load()
+        if cls is None: raise ImportError(f"{self._module}.{self._name} 不可用")
+        return cls(*args, **kwargs)
+
+def _make_llm():
+    from src.ai.llm_client import LLMClient, load_sdk
+    load_sdk()
+    return LLMClient()
+
+def _make_tavern():
+    from src.core.tavern_parser import TavernParser
+    return TavernParser()
+
+def _make_rag():
+    from src.ai.rag_engine import RAGEngine
+    return RAGEngine()
+
+# 容错 + 惰性导入 GraphEngine (networkx)
+GraphEngine = LazyClass('src.core.graph_engine', 'GraphEngine')
 
 class GlobalManagers:
     _instance = None
@@ -19,15 +90,37 @@ class GlobalManagers:
 
     def init_modules(self):
         self.pm = ProjectManager()
-        self.llm = LLMClient()
-        self.tavern = TavernParser()
-        self.rag = RAGEngine()
+        self.llm = LazyEngine("LLMClient", _make_llm)
+        self.tavern = LazyEngine("TavernParser", _make_tavern)
+        self.rag = LazyEngine("RAGEngine", _make_rag)
         self.current_graph_engine = None # 当前项目的图谱引擎
+        self._warm_task = None
 
     async def init_db(self):
         """在 app.on_startup 时调用"""
         await self.pm.init_db()
 
+    async def close_db(self):
+        """在 app.on_shutdown 时调用，释放连接池"""
+        await self.pm.close_db()
+
+    async def close_llm(self):
+        """在 app.on_shutdown 时调用，关闭模型客户端共享的 HTTP 连接池"""
+        if self.llm.ready: await self.llm.aclose()
+
+    def start_warm_up(self):
+        """在 app.on_startup 时调用：不等待预热，页面先开始服务"""
+        startup_mark("开始服务")
+        self._warm_task = asyncio.create_task(self.warm_up())
+
+    async def warm_up(self):
+        """后台线程依次构建重量级子系统；失败只记录，首次使用时会再次尝试"""
+        for engine in (self.llm, self.rag, self.tavern):
+            try: await asyncio.to_thread(engine.get)
+            except Exception as e: print(f"[Startup] {engine._name} 预热失败: {e}")
+        await asyncio.to_thread(GraphEngine.load)
+        startup_mark("后台预热完成")
+
     def load_graph(self, project_id):
         """加载指定项目的图谱引擎"""
         if GraphEngine:
@@ -36,4 +129,4 @@ class GlobalManagers:
             print("GraphEngine module not found.")
 
 # 全局单例
-mgr = GlobalManagers()
\ No newline at end of file
+mgr = GlobalManagers()
@@ -1,17 +1,32 @@
-import aiosqlite
 import uuid
 import re
 import json
+import hashlib
+import sqlite3
 from datetime import datetime
+from src.core.db_pool import DBPool
+from src.core.importer import spool_and_scan
+from src.core.chapter_manager import ChapterDetector
+from src.core import revision_store as revs
 
 DB_PATH = "data/projects/novelforge.db"
 
+# trigram 分词只能命中 >= 3 字的词，更短的词退化为逐章 instr 扫描
+FTS_MIN_TERM = 3
+
+def content_key(content: str) -> str:
+    """正文 (段落) 的内容地址 (sha256)"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
 class ProjectManager:
     def __init__(self):
         self.db_path = DB_PATH
+        self.pool = DBPool(self.db_path)
+        self.fts_enabled = False
 
     async def init_db(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        await self.pool.open()
+        async with self.pool.write() as db:
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS projects (
                     id TEXT PRIMARY KEY,
@@ -27,11 +42,135 @@ class ProjectManager:
                     project_id TEXT,
                     title TEXT,
                     order_index INTEGER,
-                    content TEXT,
+                    content TEXT, -- 旧版内联正文，迁移到分段后为 NULL
                     FOREIGN KEY(project_id) REFERENCES projects(id)
                 )
             """)
-            await db.commit()
+            # 正文按内容哈希只存一份，章节/副本只引用哈希 (写时复制)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS chapter_blobs (
+                    id INTEGER PRIMARY KEY, -- 稳定 rowid，供全文索引引用
+                    hash TEXT UNIQUE NOT NULL,
+                    content TEXT NOT NULL
+                )
+            """)
+            # 章节 = 有序段落列表，每段引用一个 blob；改一段只动一行
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS chapter_segments (
+                    chapter_id TEXT NOT NULL,
+                    seg_index INTEGER NOT NULL,
+                    blob_id INTEGER NOT NULL,
+                    PRIMARY KEY (chapter_id, seg_index)
+                ) WITHOUT ROWID
+            """)
+            # 章节版本历史：关键帧 + 段落级增量，zlib 压缩
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS chapter_revisions (
+                    chapter_id TEXT NOT NULL,
+                    rev INTEGER NOT NULL,
+                    created_at TEXT,
+                    kind TEXT NOT NULL, -- 'segs' (段落列表快照) | 'sdelta' (段落级增量)
+                    data BLOB NOT NULL,
+                    size INTEGER,
+                    PRIMARY KEY (chapter_id, rev)
+                )
+            """)
+            # 批量精修任务：每完成一段就落盘，崩溃后从断点续跑
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS batch_jobs (
+                    id TEXT PRIMARY KEY,
+                    project_id TEXT NOT NULL,
+                    status TEXT NOT NULL, -- 'running' | 'paused' | 'failed' | 'done'
+                    instruction TEXT,
+                    created_at TEXT,
+                    updated_at TEXT
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS batch_job_chapters (
+                    job_id TEXT NOT NULL,
+                    chapter_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (job_id, chapter_id)
+                ) WITHOUT ROWID
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS batch_checkpoints (
+                    job_id TEXT NOT NULL,
+                    chapter_id TEXT NOT NULL,
+                    seg_index INTEGER NOT NULL,
+                    source_hash TEXT NOT NULL, -- 原文哈希，原文变了则断点作废
+                    revised TEXT NOT NULL,
+                    PRIMARY KEY (job_id, chapter_id, seg_index)
+                ) WITHOUT ROWID
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_batch_jobs_project ON batch_jobs(project_id, status)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_segments_blob ON chapter_segments(blob_id)")
+            await self._migrate_segments(db)
+            await self._init_fts(db)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_chapters_project_order ON chapters(project_id, order_index, id)")
+
+    async def _init_fts(self, db):
+        """
+        FTS5 全文索引：外部内容表指向 chapter_blobs，正文不重复存储；
+        副本共享同一份正文，也共享同一份索引。由触发器保持同步。
+        """
+        try:
+            async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'chapter_fts'") as cursor:
+                existed = await cursor.fetchone() is not None
+            await db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chapter_fts USING fts5("
+                "content, content='chapter_blobs', content_rowid='id', tokenize='trigram')"
+            )
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS chapter_blobs_ai AFTER INSERT ON chapter_blobs BEGIN
+                    INSERT INTO chapter_fts(rowid, content) VALUES (new.id, new.content);
+                END
+            """)
+            await db.execute("""
+                CREATE TRIGGER IF NOT EXISTS chapter_blobs_ad AFTER DELETE ON chapter_blobs BEGIN
+                    INSERT INTO chapter_fts(chapter_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END
+            """)
+            if not existed:
+                await db.execute("INSERT INTO chapter_fts(chapter_fts) VALUES ('rebuild')")
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"[DB] 当前 SQLite 不支持 FTS5 trigram，全文检索退化为逐章扫描: {e}")
+            self.fts_enabled = False
+
+    async def _migrate_segments(self, db, batch: int = 200):
+        """旧库迁移：chapters.content 里的整章正文切成段落，按内容去重存进 chapter_blobs"""
+        moved = 0
+        while True:
+            async with db.execute("SELECT id, content FROM chapters WHERE content IS NOT NULL LIMIT ?", (batch,)) as cursor:
+                rows = await cursor.fetchall()
+            if not rows: break
+            for r in rows:
+                await self._insert_segments(db, r['id'], revs.split_segments(r['content']))
+            await db.executemany("UPDATE chapters SET content = NULL WHERE id = ?", [(r['id'],) for r in rows])
+            moved += len(rows)
+        if moved: print(f"[DB] 已将 {moved} 个章节迁移为分段存储 (可手动 VACUUM 回收空间)")
+
+    async def _insert_segments(self, db, chapter_id: str, segments, start: int = 0):
+        keys = [content_key(seg) for seg in segments]
+        await db.executemany("INSERT OR IGNORE INTO chapter_blobs (hash, content) VALUES (?, ?)", zip(keys, segments))
+        await db.executemany(
+            "INSERT INTO chapter_segments (chapter_id, seg_index, blob_id) SELECT ?, ?, id FROM chapter_blobs WHERE hash = ?",
+            [(chapter_id, start + i, k) for i, k in enumerate(keys)]
+        )
+
+    async def _gc_blobs(self, db, blob_ids=None):
+        """删除无人引用的正文；blob_ids 为空时全表扫描"""
+        orphan = "NOT EXISTS (SELECT 1 FROM chapter_segments s WHERE s.blob_id = chapter_blobs.id)"
+        if blob_ids is None:
+            await db.execute(f"DELETE FROM chapter_blobs WHERE {orphan}")
+        else:
+            await db.executemany(f"DELETE FROM chapter_blobs WHERE id = ? AND {orphan}", [(i,) for i in blob_ids])
+
+    async def close_db(self):
+        await self.pool.close()
 
     # --- 基础 CRUD ---
     async def create_project(self, title: str, description: str = "") -> str:
@@ -39,20 +178,19 @@ class ProjectManager:
         created_at = datetime.now().isoformat()
         # 初始化空的 settings
         settings = json.dumps({"last_polished_chapter_id": None})
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute(
                 "INSERT INTO projects (id, title, description, created_at, world_settings) VALUES (?, ?, ?, ?, ?)",
                 (project_id, title, description, created_at, settings)
             )
-            await db.commit()
         return project_id
 
-    async def duplicate_project(self, project_id: str, suffix: str = "(精修副本)") -> str:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def duplicate_project(self, project_id: str, suffix: str = "(精修副本)"):
+        """返回 (新项目 id, {原章节 id: 副本章节 id})；原项目不存在时返回 (None, {})"""
+        async with self.pool.write() as db:
             async with db.execute("SELECT * FROM projects WHERE id = ?", (project_id,)) as cursor:
                 original_project = await cursor.fetchone()
-                if not original_project: return None
+                if not original_project: return None, {}
             
             new_pid = str(uuid.uuid4())
             new_title = f"{original_project['title']} {suffix}"
@@ -62,51 +200,294 @@ class ProjectManager:
                 (new_pid, new_title, original_project['description'], datetime.now().isoformat(), original_project['world_settings'])
             )
             
-            async with db.execute("SELECT * FROM chapters WHERE project_id = ?", (project_id,)) as cursor:
-                chapters = await cursor.fetchall()
-                for ch in chapters:
-                    new_cid = str(uuid.uuid4())
-                    await db.execute(
-                        "INSERT INTO chapters (id, project_id, title, order_index, content) VALUES (?, ?, ?, ?, ?)",
-                        (new_cid, new_pid, ch['title'], ch['order_index'], ch['content'])
-                    )
-            await db.commit()
-            return new_pid
+            # 只复制章节与段落引用 (元数据)，正文不动
+            async with db.execute("SELECT id FROM chapters WHERE project_id = ?", (project_id,)) as cursor:
+                mapping = [(str(uuid.uuid4()), row[0]) for row in await cursor.fetchall()]
+            await db.executemany(
+                "INSERT INTO chapters (id, project_id, title, order_index) SELECT ?, ?, title, order_index FROM chapters WHERE id = ?",
+                [(new_cid, new_pid, old_cid) for new_cid, old_cid in mapping]
+            )
+            await db.executemany(
+                "INSERT INTO chapter_segments (chapter_id, seg_index, blob_id) SELECT ?, seg_index, blob_id FROM chapter_segments WHERE chapter_id = ?",
+                mapping
+            )
+            return new_pid, {old_cid: new_cid for new_cid, old_cid in mapping}
 
     async def delete_project(self, project_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
+            chapter_ids = "SELECT id FROM chapters WHERE project_id = ?"
+            async with db.execute(f"SELECT DISTINCT blob_id FROM chapter_segments WHERE chapter_id IN ({chapter_ids})", (project_id,)) as cursor:
+                blob_ids = [row[0] for row in await cursor.fetchall()]
+            await db.execute(f"DELETE FROM chapter_segments WHERE chapter_id IN ({chapter_ids})", (project_id,))
+            await db.execute(f"DELETE FROM chapter_revisions WHERE chapter_id IN ({chapter_ids})", (project_id,))
+            job_ids = "SELECT id FROM batch_jobs WHERE project_id = ?"
+            await db.execute(f"DELETE FROM batch_checkpoints WHERE job_id IN ({job_ids})", (project_id,))
+            await db.execute(f"DELETE FROM batch_job_chapters WHERE job_id IN ({job_ids})", (project_id,))
+            await db.execute("DELETE FROM batch_jobs WHERE project_id = ?", (project_id,))
             await db.execute("DELETE FROM chapters WHERE project_id = ?", (project_id,))
             await db.execute("DELETE FROM projects WHERE id = ?", (project_id,))
-            await db.commit()
+            await self._gc_blobs(db, blob_ids)
 
     async def get_projects(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.read() as db:
             cursor = await db.execute("SELECT * FROM projects ORDER BY created_at DESC")
             return [dict(row) for row in await cursor.fetchall()]
             
     async def get_chapters(self, project_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute("SELECT id, title, order_index FROM chapters WHERE project_id = ? ORDER BY order_index ASC", (project_id,))
+        async with self.pool.read() as db:
+            cursor = await db.execute("SELECT id, title, order_index FROM chapters WHERE project_id = ? ORDER BY order_index ASC, id ASC", (project_id,))
             return [dict(row) for row in await cursor.fetchall()]
 
-    async def get_chapter_content(self, chapter_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT content FROM chapters WHERE id = ?", (chapter_id,))
+    async def get_chapters_page(self, project_id: str, after=None, limit: int = 200):
+        """
+        键集分页：after 为上一页最后一行的 (order_index, id)，None 表示第一页。
+        走 (project_id, order_index, id) 索引，翻页成本与页码无关。
+        """
+        async with self.pool.read() as db:
+            if after is None:
+                cursor = await db.execute(
+                    "SELECT id, title, order_index FROM chapters WHERE project_id = ? ORDER BY order_index ASC, id ASC LIMIT ?",
+                    (project_id, limit)
+                )
+            else:
+                cursor = await db.execute(
+                    "SELECT id, title, order_index FROM chapters WHERE project_id = ? AND (order_index, id) > (?, ?) "
+                    "ORDER BY order_index ASC, id ASC LIMIT ?",
+                    (project_id, after[0], after[1], limit)
+                )
+            return [dict(row) for row in await cursor.fetchall()]
+
+    async def get_chapter_order(self, chapter_id: str):
+        """章节的 order_index (向量记忆与图谱按它判断先后)，不存在返回 None"""
+        async with self.pool.read() as db:
+            cursor = await db.execute("SELECT order_index FROM chapters WHERE id = ?", (chapter_id,))
             row = await cursor.fetchone()
-            return row[0] if row else ""
+            return row[0] if row else None
+
+    async def _read_segments(self, db, chapter_id: str, start: int = 0, count: int = None):
+        end = start + count if count is not None else -1
+        async with db.execute(
+            "SELECT b.content FROM chapter_segments s JOIN chapter_blobs b ON b.id = s.blob_id "
+            "WHERE s.chapter_id = ? AND s.seg_index >= ? AND (? < 0 OR s.seg_index < ?) ORDER BY s.seg_index ASC",
+            (chapter_id, start, end, end)
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def get_chapter_content(self, chapter_id: str):
+        async with self.pool.read() as db:
+            return revs.join_segments(await self._read_segments(db, chapter_id))
+
+    async def get_chapter_segments(self, chapter_id: str, start: int = 0, count: int = None):
+        """按段读取：只取 [start, start + count) 范围，count 为 None 时读到末尾"""
+        async with self.pool.read() as db:
+            return await self._read_segments(db, chapter_id, start, count)
+
+    async def count_chapter_segments(self, chapter_id: str) -> int:
+        async with self.pool.read() as db:
+            async with db.execute("SELECT COUNT(*) FROM chapter_segments WHERE chapter_id = ?", (chapter_id,)) as cursor:
+                return (await cursor.fetchone())[0]
 
     async def update_chapter_content(self, chapter_id: str, new_content: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("UPDATE chapters SET content = ? WHERE id = ?", (new_content, chapter_id))
-            await db.commit()
+        """整章保存：按段比对哈希，只写入变化的段落行"""
+        segments = revs.split_segments(new_content)
+        async with self.pool.write() as db:
+            async with db.execute("SELECT 1 FROM chapters WHERE id = ?", (chapter_id,)) as cursor:
+                if not await cursor.fetchone(): return
+            async with db.execute(
+                "SELECT s.seg_index, s.blob_id, b.hash FROM chapter_segments s JOIN chapter_blobs b ON b.id = s.blob_id "
+                "WHERE s.chapter_id = ? ORDER BY s.seg_index ASC", (chapter_id,)
+            ) as cursor:
+                old = await cursor.fetchall()
+            old_keys = [r['hash'] for r in old]
+            new_keys = [content_key(seg) for seg in segments]
+            if old_keys == new_keys: return
+            # 首次保存需要补记原文作为 v1，必须在覆盖前读取
+            baseline = await self._read_segments(db, chapter_id) if not await self._has_revisions(db, chapter_id) else None
+
+            changed = [i for i, k in enumerate(new_keys) if i >= len(old_keys) or old_keys[i] != k]
+            await db.executemany("INSERT OR IGNORE INTO chapter_blobs (hash, content) VALUES (?, ?)", [(new_keys[i], segments[i]) for i in changed])
+            await db.executemany(
+                "UPDATE chapter_segments SET blob_id = (SELECT id FROM chapter_blobs WHERE hash = ?) WHERE chapter_id = ? AND seg_index = ?",
+                [(new_keys[i], chapter_id, i) for i in changed if i < len(old_keys)]
+            )
+            await db.executemany(
+                "INSERT INTO chapter_segments (chapter_id, seg_index, blob_id) SELECT ?, ?, id FROM chapter_blobs WHERE hash = ?",
+                [(chapter_id, i, new_keys[i]) for i in changed if i >= len(old_keys)]
+            )
+            await db.execute("DELETE FROM chapter_segments WHERE chapter_id = ? AND seg_index >= ?", (chapter_id, len(new_keys)))
+            stale = {old[i]['blob_id'] for i in range(len(old)) if i >= len(new_keys) or old_keys[i] != new_keys[i]}
+            await self._gc_blobs(db, stale)
+
+            ops = revs.diff_ops(old_keys, new_keys, segments)
+            await self._record_revision(db, chapter_id, ops, len(revs.join_segments(segments)), baseline, segments)
+
+    async def update_segment(self, chapter_id: str, seg_index: int, text: str) -> bool:
+        """
+        原地替换单个段落 (只写一行)。text 含换行或索引越界时返回 False，
+        调用方应改用 update_chapter_content。
+        """
+        text = (text or "").strip()
+        if not text or '\n' in text: return False
+        async with self.pool.write() as db:
+            async with db.execute(
+                "SELECT s.blob_id, b.content, (SELECT COUNT(*) FROM chapter_segments WHERE chapter_id = ?) AS total "
+                "FROM chapter_segments s JOIN chapter_blobs b ON b.id = s.blob_id WHERE s.chapter_id = ? AND s.seg_index = ?",
+                (chapter_id, chapter_id, seg_index)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if not row: return False
+            if row['content'] == text: return True
+            baseline = await self._read_segments(db, chapter_id) if not await self._has_revisions(db, chapter_id) else None
+            key = content_key(text)
+            await db.execute("INSERT OR IGNORE INTO chapter_blobs (hash, content) VALUES (?, ?)", (key, text))
+            await db.execute(
+                "UPDATE chapter_segments SET blob_id = (SELECT id FROM chapter_blobs WHERE hash = ?) WHERE chapter_id = ? AND seg_index = ?",
+                (key, chapter_id, seg_index)
+            )
+            await self._gc_blobs(db, [row['blob_id']])
+
+            async with db.execute("SELECT size FROM chapter_revisions WHERE chapter_id = ? ORDER BY rev DESC LIMIT 1", (chapter_id,)) as cursor:
+                prev = await cursor.fetchone()
+            if baseline is not None:
+                size = len(revs.join_segments(baseline)) - len(row['content']) + len(text)
+            else:
+                size = (prev[0] or 0) - len(row['content']) + len(text)
+            await self._record_revision(db, chapter_id, revs.replace_ops(seg_index, text, row['total']), size, baseline)
+            return True
+
+    # --- 全文检索 ---
+    @staticmethod
+    def _search_terms(query: str):
+        terms = [t for t in re.split(r'[\s,，、;；。|]+', query or "") if t]
+        return list(dict.fromkeys(terms))
+
+    @staticmethod
+    def _make_snippet(content: str, terms, width: int = 30):
+        hits = [(content.find(t), t) for t in terms]
+        hits = [h for h in hits if h[0] >= 0]
+        if not hits: return content[:width * 2]
+        pos, term = min(hits)
+        start = max(pos - width, 0)
+        end = pos + len(term) + width
+        text = content[start:pos] + f"【{term}】" + content[pos + len(term):end]
+        return ("…" if start > 0 else "") + text + ("…" if end < len(content) else "")
+
+    async def search_chapters(self, project_id: str, query: str, limit: int = 10, order_by: str = 'rank'):
+        """
+        关键词精确检索。query 可含多个词 (空格/逗号分隔)，任一命中即返回。
+        order_by='rank' 按 bm25 相关度，'position' 按章节顺序 (用于“首次出现”)。
+        命中粒度为段落，返回 [{chapter_id, title, order_index, seg_index, snippet}]。
+        """
+        terms = self._search_terms(query)
+        if not terms: return []
+        order = "c.order_index ASC, s.seg_index ASC" if order_by == 'position' else "rank"
+        async with self.pool.read() as db:
+            if self.fts_enabled and all(len(t) >= FTS_MIN_TERM for t in terms):
+                match = " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+                cursor = await db.execute(
+                    "SELECT c.id AS chapter_id, c.title, c.order_index, s.seg_index, "
+                    "snippet(chapter_fts, 0, '【', '】', '…', 24) AS snippet, bm25(chapter_fts) AS rank "
+                    "FROM chapter_fts JOIN chapter_segments s ON s.blob_id = chapter_fts.rowid "
+                    "JOIN chapters c ON c.id = s.chapter_id "
+                    f"WHERE chapter_fts MATCH ? AND c.project_id = ? ORDER BY {order} LIMIT ?",
+                    (match, project_id, limit)
+                )
+                return [dict(row) for row in await cursor.fetchall()]
+            # 短词 (如两字人名) 无法走 trigram，按章节顺序扫描
+            cond = " OR ".join("instr(b.content, ?) > 0" for _ in terms)
+            cursor = await db.execute(
+                "SELECT c.id AS chapter_id, c.title, c.order_index, s.seg_index, b.content FROM chapters c "
+                "JOIN chapter_segments s ON s.chapter_id = c.id JOIN chapter_blobs b ON b.id = s.blob_id "
+                f"WHERE c.project_id = ? AND ({cond}) ORDER BY c.order_index ASC, s.seg_index ASC LIMIT ?",
+                (project_id, *terms, limit)
+            )
+            rows = await cursor.fetchall()
+            return [{'chapter_id': r['chapter_id'], 'title': r['title'], 'order_index': r['order_index'],
+                     'seg_index': r['seg_index'], 'snippet': self._make_snippet(r['content'], terms)} for r in rows]
+
+    # --- 版本历史 ---
+    async def _has_revisions(self, db, chapter_id: str) -> bool:
+        async with db.execute("SELECT 1 FROM chapter_revisions WHERE chapter_id = ? LIMIT 1", (chapter_id,)) as cursor:
+            return await cursor.fetchone() is not None
+
+    async def _insert_revision(self, db, chapter_id: str, rev: int, kind: str, obj, size: int):
+        await db.execute("INSERT INTO chapter_revisions (chapter_id, rev, created_at, kind, data, size) VALUES (?, ?, ?, ?, ?, ?)",
+            (chapter_id, rev, datetime.now().isoformat(), kind, revs.pack(obj), size))
+
+    async def _record_revision(self, db, chapter_id: str, ops, size: int, baseline=None, segments=None):
+        """
+        ops 为相对上一版本的段落级增量。baseline 非空时先补记为 v1 (导入时的原文)；
+        到关键帧时存完整段落列表，segments 为空则从库里读取当前内容。
+        """
+        async with db.execute("SELECT MAX(rev), COUNT(*) FROM chapter_revisions WHERE chapter_id = ?", (chapter_id,)) as cursor:
+            last, count = await cursor.fetchone()
+        last = last or 0
+        if last == 0 and baseline:
+            await self._insert_revision(db, chapter_id, 1, 'segs', baseline, len(revs.join_segments(baseline)))
+            last, count = 1, 1
+        rev = last + 1
+        if last == 0 or revs.is_keyframe(rev):
+            if segments is None: segments = await self._read_segments(db, chapter_id)
+            await self._insert_revision(db, chapter_id, rev, 'segs', segments, size)
+        else:
+            await self._insert_revision(db, chapter_id, rev, 'sdelta', ops, size)
+        # 摊销压缩：超出保留数一个关键帧间隔后再整理
+        if count + 1 > revs.MAX_REVISIONS + revs.KEYFRAME_INTERVAL:
+            await self._compact(db, chapter_id, revs.MAX_REVISIONS)
+
+    async def _checkout(self, db, chapter_id: str, rev: int):
+        async with db.execute(
+            "SELECT kind, data FROM chapter_revisions WHERE chapter_id = ? AND rev <= ? AND rev >= "
+            "(SELECT MAX(rev) FROM chapter_revisions WHERE chapter_id = ? AND rev <= ? AND kind = 'segs') ORDER BY rev ASC",
+            (chapter_id, rev, chapter_id, rev)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return revs.replay([(r[0], r[1]) for r in rows]) if rows else None
+
+    async def _compact(self, db, chapter_id: str, keep: int):
+        async with db.execute("SELECT rev, kind FROM chapter_revisions WHERE chapter_id = ? ORDER BY rev DESC LIMIT 1 OFFSET ?", (chapter_id, keep - 1)) as cursor:
+            row = await cursor.fetchone()
+        if not row: return 0
+        cutoff, kind = row
+        # 最老的保留版本必须是完整快照，才能独立回放
+        if kind != 'segs':
+            segments = await self._checkout(db, chapter_id, cutoff)
+            await db.execute("UPDATE chapter_revisions SET kind = 'segs', data = ? WHERE chapter_id = ? AND rev = ?",
+                (revs.pack(segments), chapter_id, cutoff))
+        cursor = await db.execute("DELETE FROM chapter_revisions WHERE chapter_id = ? AND rev < ?", (chapter_id, cutoff))
+        return cursor.rowcount
+
+    async def list_revisions(self, chapter_id: str):
+        """返回版本列表 (新 -> 旧)，stored 为压缩后占用字节"""
+        async with self.pool.read() as db:
+            cursor = await db.execute(
+                "SELECT rev, created_at, kind, size, length(data) AS stored FROM chapter_revisions WHERE chapter_id = ? ORDER BY rev DESC",
+                (chapter_id,)
+            )
+            return [dict(row) for row in await cursor.fetchall()]
+
+    async def checkout_revision(self, chapter_id: str, rev: int):
+        async with self.pool.read() as db:
+            segments = await self._checkout(db, chapter_id, rev)
+        return revs.join_segments(segments) if segments is not None else None
+
+    async def restore_revision(self, chapter_id: str, rev: int):
+        """回滚到指定版本 (作为新版本写入，历史不丢)"""
+        text = await self.checkout_revision(chapter_id, rev)
+        if text is None: return None
+        await self.update_chapter_content(chapter_id, text)
+        return text
+
+    async def compact_revisions(self, chapter_id: str, keep: int = revs.MAX_REVISIONS):
+        """保留最近 keep 个版本，返回删除的版本数"""
+        async with self.pool.write() as db:
+            return await self._compact(db, chapter_id, keep)
 
     # --- 新增：进度存取 ---
     async def save_progress(self, project_id: str, chapter_id: str):
         """记录当前精修到了哪一章"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # 先读取旧配置
+        async with self.pool.write() as db:
+            # 先读取旧配置 (写锁内完成读-改-写，避免并发覆盖)
             async with db.execute("SELECT world_settings FROM projects WHERE id = ?", (project_id,)) as cursor:
                 row = await cursor.fetchone()
                 current_settings = json.loads(row[0]) if row and row[0] else {}
@@ -114,11 +495,10 @@ class ProjectManager:
             current_settings['last_polished_chapter_id'] = chapter_id
             
             await db.execute("UPDATE projects SET world_settings = ? WHERE id = ?", (json.dumps(current_settings), project_id))
-            await db.commit()
 
     async def get_progress(self, project_id: str):
         """获取上次精修的章节ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.read() as db:
             async with db.execute("SELECT world_settings FROM projects WHERE id = ?", (project_id,)) as cursor:
                 row = await cursor.fetchone()
                 if row and row[0]:
@@ -126,44 +506,153 @@ class ProjectManager:
                     return settings.get('last_polished_chapter_id')
         return None
 
-    # --- 导入逻辑 (保持不变) ---
-    def _clean_text(self, text: str) -> str:
-        return text.replace("\xa0", " ").replace("\u3000", " ").replace("\r\n", "\n").replace("\r", "\n")
-
-    async def import_content(self, project_id: str, content: str):
-        content = self._clean_text(content)
-        patterns = [
-            r'(?m)^\s*(?:第[0-9零一二三四五六七八九十百千]+[章卷]|Chapter\s*\d+|Vol\.\d+).*?$',
-            r'(?m)^\s*\d+\.\s+.{0,30}$',
-            r'(?m)^\s*[【\[]\s*.*?\s*[】\]].*?$',
-            r'(?m)^\s*(?!.*[。，？！……：]$).{2,20}\s*$' 
-        ]
-        matches = []
-        for p in patterns:
-            regex = re.compile(p)
-            temp_matches = list(regex.finditer(content))
-            if len(temp_matches) > 2:
-                matches = temp_matches
-                break
-        
-        async with aiosqlite.connect(self.db_path) as db:
-            if not matches:
-                await db.execute("INSERT INTO chapters (id, project_id, title, order_index, content) VALUES (?, ?, ?, ?, ?)",
-                    (str(uuid.uuid4()), project_id, "全文", 0, content))
+    # --- 批量任务断点 ---
+    async def create_batch_job(self, project_id: str, chapter_ids, instruction: str = "") -> str:
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        async with self.pool.write() as db:
+            # 同一项目只保留一个未完成任务，新任务开始时旧断点作废
+            await self._discard_open_jobs(db, project_id)
+            await db.execute(
+                "INSERT INTO batch_jobs (id, project_id, status, instruction, created_at, updated_at) VALUES (?, ?, 'running', ?, ?, ?)",
+                (job_id, project_id, instruction, now, now)
+            )
+            await db.executemany(
+                "INSERT INTO batch_job_chapters (job_id, chapter_id, position) VALUES (?, ?, ?)",
+                [(job_id, cid, i) for i, cid in enumerate(chapter_ids)]
+            )
+        return job_id
+
+    async def _discard_open_jobs(self, db, project_id: str):
+        open_jobs = "SELECT id FROM batch_jobs WHERE project_id = ? AND status != 'done'"
+        await db.execute(f"DELETE FROM batch_checkpoints WHERE job_id IN ({open_jobs})", (project_id,))
+        await db.execute(f"DELETE FROM batch_job_chapters WHERE job_id IN ({open_jobs})", (project_id,))
+        await db.execute("DELETE FROM batch_jobs WHERE project_id = ? AND status != 'done'", (project_id,))
+
+    async def get_open_batch_job(self, project_id: str):
+        """
+        返回项目最近一个未完成的任务 (含意外中断时仍为 'running' 的)，附带进度：
+        {id, status, instruction, updated_at, total, done, segments}；没有则返回 None
+        """
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT j.id, j.status, j.instruction, j.updated_at, "
+                "(SELECT COUNT(*) FROM batch_job_chapters WHERE job_id = j.id) AS total, "
+                "(SELECT COUNT(*) FROM batch_job_chapters WHERE job_id = j.id AND done = 1) AS done, "
+                "(SELECT COUNT(*) FROM batch_checkpoints WHERE job_id = j.id) AS segments "
+                "FROM batch_jobs j WHERE j.project_id = ? AND j.status != 'done' ORDER BY j.created_at DESC LIMIT 1",
+                (project_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return dict(row) if row else None
+
+    async def get_pending_batch_chapters(self, job_id: str):
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT chapter_id FROM batch_job_chapters WHERE job_id = ? AND done = 0 ORDER BY position ASC", (job_id,)
+            ) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def get_batch_checkpoints(self, job_id: str, chapter_id: str):
+        """返回 {seg_index: (原文哈希, 改写结果)}"""
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT seg_index, source_hash, revised FROM batch_checkpoints WHERE job_id = ? AND chapter_id = ?", (job_id, chapter_id)
+            ) as cursor:
+                return {r[0]: (r[1], r[2]) for r in await cursor.fetchall()}
+
+    async def save_batch_checkpoint(self, job_id: str, chapter_id: str, seg_index: int, original: str, revised: str):
+        """每段改写完成后立即提交，崩溃最多损失正在进行的一段"""
+        async with self.pool.write() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO batch_checkpoints (job_id, chapter_id, seg_index, source_hash, revised) VALUES (?, ?, ?, ?, ?)",
+                (job_id, chapter_id, seg_index, content_key(original), revised)
+            )
+
+    async def finish_batch_chapter(self, job_id: str, chapter_id: str):
+        """章节已整体保存，逐段断点不再需要"""
+        async with self.pool.write() as db:
+            await db.execute("UPDATE batch_job_chapters SET done = 1 WHERE job_id = ? AND chapter_id = ?", (job_id, chapter_id))
+            await db.execute("DELETE FROM batch_checkpoints WHERE job_id = ? AND chapter_id = ?", (job_id, chapter_id))
+            await db.execute("UPDATE batch_jobs SET updated_at = ? WHERE id = ?", (datetime.now().isoformat(), job_id))
+
+    async def set_batch_job_status(self, job_id: str, status: str):
+        async with self.pool.write() as db:
+            await db.execute("UPDATE batch_jobs SET status = ?, updated_at = ? WHERE id = ?", (status, datetime.now().isoformat(), job_id))
+            if status == 'done':
+                await db.execute("DELETE FROM batch_checkpoints WHERE job_id = ?", (job_id,))
+
+    async def discard_batch_job(self, project_id: str):
+        async with self.pool.write() as db:
+            await self._discard_open_jobs(db, project_id)
+
+    # --- 导入逻辑 (流式) ---
+    IMPORT_BATCH = 5000  # 每批写入的段落数
+
+    def _iter_chapters(self, spool, boundaries):
+        """按标题行号切分 spool，产出 (title, order_index, 段落可迭代对象)"""
+        if not boundaries:
+            # 无标题时整本作为一章，段落直接从 spool 流出，不在内存里拼全文
+            yield "全文", 0, (line.strip() for line in spool if line.strip())
+            return
+        next_b = iter(boundaries)
+        upcoming = next(next_b, None)
+        idx, title, buf = -1, None, []
+        for line_no, line in enumerate(spool):
+            if line_no == upcoming:
+                yield from self._finish_chapter(idx, title, buf)
+                idx += 1; title = line.strip(); buf = []
+                upcoming = next(next_b, None)
             else:
-                if matches[0].start() > 0:
-                    preface = content[:matches[0].start()].strip()
-                    if preface:
-                        await db.execute("INSERT INTO chapters (id, project_id, title, order_index, content) VALUES (?, ?, ?, ?, ?)",
-                            (str(uuid.uuid4()), project_id, "【序章】", -1, preface))
-
-                for i, match in enumerate(matches):
-                    title = match.group().strip()
-                    start = match.end()
-                    end = matches[i+1].start() if i + 1 < len(matches) else len(content)
-                    chapter_content = content[start:end].strip()
-                    if len(chapter_content) < 10: continue
-                    await db.execute("INSERT INTO chapters (id, project_id, title, order_index, content) VALUES (?, ?, ?, ?, ?)",
-                        (str(uuid.uuid4()), project_id, title, i, chapter_content))
-            await db.commit()
-            return len(matches) if matches else 1
\ No newline at end of file
+                line = line.strip()
+                if line: buf.append(line)
+        yield from self._finish_chapter(idx, title, buf)
+
+    def _finish_chapter(self, idx, title, buf):
+        if idx < 0:
+            if buf: yield "【序章】", -1, buf
+        elif sum(len(seg) for seg in buf) >= 10:
+            yield title, idx, buf
+
+    async def import_content(self, project_id: str, content, encoding: str = None, progress_callback=None):
+        """
+        content 可以是 str、bytes、文件对象或块迭代器；encoding 为 None 时自动探测。
+        先单遍扫描落盘并为各标题样式打分，再分批 executemany 写入，全程在一个事务内。
+        progress_callback(msg, p) 与 GraphEngine 的状态回调签名一致。
+        """
+        detector = ChapterDetector()
+        spool = await spool_and_scan(content, detector, encoding, progress_callback)
+        try:
+            style, boundaries = detector.detect()
+            if style: print(f"[Import] 章节样式: {style}，共 {len(boundaries)} 个标题")
+            batch = {'chapters': [], 'blobs': [], 'segments': []}
+
+            async def flush(db):
+                await db.executemany("INSERT INTO chapters (id, project_id, title, order_index) VALUES (?, ?, ?, ?)", batch['chapters'])
+                await db.executemany("INSERT OR IGNORE INTO chapter_blobs (hash, content) VALUES (?, ?)", batch['blobs'])
+                await db.executemany(
+                    "INSERT INTO chapter_segments (chapter_id, seg_index, blob_id) SELECT ?, ?, id FROM chapter_blobs WHERE hash = ?",
+                    batch['segments']
+                )
+                for rows in batch.values(): rows.clear()
+
+            written = 0
+            async with self.pool.write() as db:
+                for title, order_index, segments in self._iter_chapters(spool, boundaries):
+                    chapter_id = None
+                    for i, seg in enumerate(segments):
+                        if chapter_id is None:
+                            chapter_id = str(uuid.uuid4()); written += 1
+                            batch['chapters'].append((chapter_id, project_id, title, order_index))
+                        key = content_key(seg)
+                        batch['blobs'].append((key, seg))
+                        batch['segments'].append((chapter_id, i, key))
+                        if len(batch['segments']) >= self.IMPORT_BATCH:
+                            await flush(db)
+                            if progress_callback:
+                                progress_callback(f"正在写入章节 ({written})...", 0.5 + 0.5 * min(order_index / max(len(boundaries), 1), 1.0))
+                await flush(db)
+            if progress_callback: progress_callback("导入完成", 1.0)
+            return len(boundaries) if boundaries else 1
+        finally:
+            spool.close()
@@ -0,0 +1,55 @@
+import difflib
+import json
+import zlib
+
+# 每隔多少个版本存一次完整快照，限制 checkout 时需要回放的增量数
+KEYFRAME_INTERVAL = 20
+# 每章默认保留的版本数 (超出后压缩)
+MAX_REVISIONS = 50
+
+def split_segments(text: str):
+    """与编辑器分段规则一致：按行切分，去掉空行与首尾空白"""
+    return [line.strip() for line in (text or "").split('\n') if line.strip()]
+
+def join_segments(segments) -> str:
+    return "\n\n".join(segments)
+
+def diff_ops(a, b, b_items=None) -> list:
+    """
+    序列增量：[[0, i1, i2], ...] 表示复制 a[i1:i2]，[[1, [...]]] 表示插入新元素。
+    b_items 为 b 对应的实际内容 (a/b 可以是哈希列表，插入时取 b_items)。
+    """
+    if b_items is None: b_items = b
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal': ops.append([0, i1, i2])
+        elif j2 > j1: ops.append([1, list(b_items[j1:j2])])
+    return ops
+
+def apply_ops(base: list, ops: list) -> list:
+    out = []
+    for op in ops:
+        if op[0] == 0: out.extend(base[op[1]:op[2]])
+        else: out.extend(op[1])
+    return out
+
+def replace_ops(index: int, segment: str, count: int) -> list:
+    """单段替换的增量"""
+    return [[0, 0, index], [1, [segment]], [0, index + 1, count]]
+
+def pack(obj) -> bytes:
+    return zlib.compress(json.dumps(obj, ensure_ascii=False).encode('utf-8'), 9)
+
+def unpack(data: bytes):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def is_keyframe(rev: int) -> bool:
+    return rev % KEYFRAME_INTERVAL == 1
+
+def replay(rows) -> list:
+    """rows: 从关键帧 ('segs') 开始按版本号升序的 (kind, data)，依次应用段落级增量 ('sdelta')，返回段落列表"""
+    segments = []
+    for kind, data in rows:
+        obj = unpack(data)
+        segments = obj if kind == 'segs' else apply_ops(segments, obj)
+    return segments
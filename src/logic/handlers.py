@@ -1,9 +1,13 @@
 from nicegui import ui
 from src.core.managers import mgr, GraphEngine
+from src.core.project_manager import content_key
+from src.core.importer import spool_upload, source_size
+from src.ai.llm_scheduler import scheduler, PRIORITY_BATCH
 from src.ui.state import app_state
 import asyncio
 import json
 import functools
+import threading
 
 # ==========================
 # 0. 基础工具 (防御性)
@@ -35,6 +39,7 @@ def update_status(msg, p=None):
 
 def stop_workflow(): 
     app_state.stop_signal = True
+    cancel_index_job()
     ui.notify('已发送停止信号', type='warning')
 
 def split_text(text):
@@ -66,28 +71,21 @@ def clean_json_response(text):
     except: pass
     return None
 
-async def _extract_upload_info(e):
+async def _open_upload(e):
+    """返回 (文件名, 落盘后的二进制文件对象, 是否需要调用方关闭)"""
     filename = "unknown_file"
     if hasattr(e, 'name'): filename = e.name
     elif hasattr(e, 'file') and hasattr(e.file, 'name'): filename = e.file.name
-    content = b""
     file_obj = None
     if hasattr(e, 'content'): file_obj = e.content
     elif hasattr(e, 'file'): file_obj = e.file
-    if file_obj:
-        if hasattr(file_obj, 'read'):
-            try: content = await file_obj.read()
-            except: content = file_obj.read()
-        elif hasattr(file_obj, '_data'):
-            content = file_obj._data
-    return filename, content
-
-async def _get_current_chapter_index():
-    if not app_state.current_project_id or not app_state.current_chapter_id: return 0
-    chs = await mgr.pm.get_chapters(app_state.current_project_id)
-    for i, c in enumerate(chs):
-        if c['id'] == app_state.current_chapter_id: return i + 1
-    return 0
+    f, owned = await spool_upload(file_obj)
+    return filename, f, owned
+
+async def _get_current_chapter_order():
+    """当前章节的 order_index：RAG 与图谱的读者视角只看到这一章及之前的内容；无当前章节返回 None (不限)"""
+    if not app_state.current_project_id or not app_state.current_chapter_id: return None
+    return await mgr.pm.get_chapter_order(app_state.current_chapter_id)
 
 # ==========================
 # 2. 图谱逻辑
@@ -101,7 +99,37 @@ def refresh_graph_ui():
         app_state.ui['graph_chart'].options['series'][0]['links'] = data['links']
         app_state.ui['graph_chart'].update()
 
-async def bg_build_graph(pid, content, incremental=False):
+# 导入后的后台向量化任务 (同一时间只跑一个)
+_index_job = {'task': None, 'cancel': None}
+
+def cancel_index_job():
+    if _index_job['cancel']: _index_job['cancel'].set()
+
+async def _iter_chapter_texts(chs):
+    for c in chs:
+        txt = await mgr.pm.get_chapter_content(c['id'])
+        if txt: yield c['id'], txt, c['order_index']
+
+async def bg_index_project(pid):
+    cancel_index_job()
+    cancel = threading.Event()
+    _index_job['cancel'] = cancel
+    try:
+        chs = await mgr.pm.get_chapters(pid)
+        update_status("正在初始化向量记忆...", 0.0)
+        rag = await mgr.rag.aget()
+        await rag.index_project(pid, _iter_chapter_texts(chs), total=len(chs), progress_callback=update_status, cancel=cancel)
+        update_status("向量化已取消 (保存章节时会补齐)" if cancel.is_set() else "向量记忆已就绪", 1.0)
+    finally:
+        if _index_job['cancel'] is cancel: _index_job['cancel'] = None
+
+def start_index_job(pid):
+    _index_job['task'] = asyncio.create_task(bg_index_project(pid))
+
+# 图谱提取每次送给模型的切片长度 (长章节切成多片，同属该章的 order_index)
+GRAPH_SLICE = 3000
+
+async def bg_build_graph(pid, chapters, incremental=False):
     if not GraphEngine: return
     
     g_conf = app_state.settings.get_role_config('graph')
@@ -118,14 +146,6 @@ async def bg_build_graph(pid, content, incremental=False):
     app_state.graph_task_running = True
     mgr.load_graph(pid)
     
-    chapters = []
-    if '第' in content[:1000]: 
-        chapters = [{'title': f'Ch{i}', 'content': c} for i, c in enumerate(content.split('第')) if len(c) > 100]
-    if len(chapters) < 1:
-        chunk_size = 3000
-        for i in range(0, len(content), chunk_size):
-            chapters.append({'title': f'Part {i//chunk_size + 1}', 'content': content[i:i+chunk_size]})
-
     update_status(f"正在分析 {len(chapters)} 个切片...", 0.1)
 
     await mgr.current_graph_engine.build_graph_from_chapters(
@@ -138,16 +158,20 @@ async def bg_build_graph(pid, content, incremental=False):
     update_status("✅ 图谱构建完成", 1.0)
     refresh_graph_ui()
 
+async def _collect_project_chapters(pid):
+    """按真实章节切片 (带 order_index)，图谱的揭示章节与 RAG 记忆用同一套先后顺序"""
+    parts = []
+    for c in await mgr.pm.get_chapters(pid):
+        txt = await mgr.pm.get_chapter_content(c['id'])
+        for i in range(0, len(txt), GRAPH_SLICE):
+            parts.append({'title': c['title'], 'content': txt[i:i + GRAPH_SLICE], 'order_index': c['order_index']})
+    return parts
+
 async def update_graph_incrementally():
     if not app_state.current_project_id: return
     ui.notify('全书扫描中...')
-    chs = await mgr.pm.get_chapters(app_state.current_project_id)
-    full_content = ""
-    for c in chs:
-        txt = await mgr.pm.get_chapter_content(c['id'])
-        full_content += f"第{c['title']}\n{txt}\n"
-    
-    asyncio.create_task(bg_build_graph(app_state.current_project_id, full_content, incremental=True))
+    chapters = await _collect_project_chapters(app_state.current_project_id)
+    asyncio.create_task(bg_build_graph(app_state.current_project_id, chapters, incremental=True))
 
 # ==========================
 # 3. 项目与 IO
@@ -155,23 +179,63 @@ async def update_graph_incrementally():
 _renderer = None
 def register_renderer(func): global _renderer; _renderer = func
 
+CHAPTER_PAGE_SIZE = 200
+# 章节列表渲染状态：已渲染的项目、各章节对应的 label、当前高亮项
+_chapter_list = {'pid': None, 'container': None, 'gen': 0, 'items': {}, 'active': None, 'loading': False}
+
 @safe_async
 async def refresh_chapter_list():
-    if not app_state.ui['chapter_list']: return
-    app_state.ui['chapter_list'].clear()
-    if not app_state.current_project_id: return
-    
-    chs = await mgr.pm.get_chapters(app_state.current_project_id)
-    with app_state.ui['chapter_list']:
-        for c in chs:
-            act = ' active-chapter' if app_state.current_chapter_id == c['id'] else ''
-            ui.label(c['title']).classes(f'w-full px-4 py-2 text-sm cursor-pointer border-b chapter-item{act}').on('click', lambda _,cid=c['id']: load_chapter(cid))
+    """分页增量渲染章节列表；首屏先出，后续页逐批追加"""
+    container = app_state.ui['chapter_list']
+    if not container: return
+    container.clear()
+    _chapter_list['gen'] += 1; gen = _chapter_list['gen']
+    _chapter_list.update(items={}, active=None, container=container)
+    pid = _chapter_list['pid'] = app_state.current_project_id
+    if not pid: return
+
+    _chapter_list['loading'] = True
+    after = None
+    try:
+        while True:
+            page = await mgr.pm.get_chapters_page(pid, after, CHAPTER_PAGE_SIZE)
+            if gen != _chapter_list['gen']: return  # 已被新的刷新取代
+            with container:
+                for c in page:
+                    _chapter_list['items'][c['id']] = ui.label(c['title']).classes('w-full px-4 py-2 text-sm cursor-pointer border-b chapter-item').on('click', lambda _,cid=c['id']: load_chapter(cid))
+            if _chapter_list['active'] is None:
+                _set_active_chapter(_chapter_list['items'].get(app_state.current_chapter_id))
+            if len(page) < CHAPTER_PAGE_SIZE: break
+            after = (page[-1]['order_index'], page[-1]['id'])
+            await asyncio.sleep(0)
+    finally:
+        if gen == _chapter_list['gen']: _chapter_list['loading'] = False
+
+def _set_active_chapter(item):
+    prev = _chapter_list['active']
+    if prev is item: return
+    if prev is not None: prev.classes(remove='active-chapter')
+    if item is not None: item.classes(add='active-chapter')
+    _chapter_list['active'] = item
+
+@safe_async
+async def sync_chapter_list():
+    """切换章节时只移动高亮；项目变化或列表未建时才整表重建"""
+    stale = _chapter_list['pid'] != app_state.current_project_id or _chapter_list['container'] is not app_state.ui['chapter_list']
+    if stale or not _chapter_list['items']:
+        return await refresh_chapter_list()
+    item = _chapter_list['items'].get(app_state.current_chapter_id)
+    if item is None:
+        if _chapter_list['loading']: return  # 仍在分页加载，加载到该章时会自动高亮
+        return await refresh_chapter_list()
+    _set_active_chapter(item)
 
 async def load_chapter(cid):
-    c = await mgr.pm.get_chapter_content(cid)
-    if c:
+    # 直接按段读取，无需先拼全文再切分
+    segs = await mgr.pm.get_chapter_segments(cid)
+    if segs:
         app_state.current_chapter_id = cid
-        app_state.segments = split_text(c)
+        app_state.segments = [{'original': seg, 'revised': ''} for seg in segs]
         
         # 【核心修复】同步全文草稿
         lines = [s['revised'] if s['revised'] else s['original'] for s in app_state.segments]
@@ -180,7 +244,13 @@ async def load_chapter(cid):
         if _renderer: 
             try: _renderer()
             except RuntimeError: pass
-        await refresh_chapter_list()
+        await sync_chapter_list()
+
+@safe_async
+async def _backfill_order_index(pid, order_map):
+    # RAG 未预热完时在线程里构建，不阻塞切换项目
+    rag = await mgr.rag.aget()
+    await rag.abackfill_order_index(pid, order_map)
 
 @safe_async
 async def switch_project(pid, title):
@@ -193,6 +263,8 @@ async def switch_project(pid, title):
         
     mgr.load_graph(pid)
     chs = await mgr.pm.get_chapters(pid)
+    # 旧版记忆缺少章节序号时在后台补齐 (只改 metadata)
+    if chs: asyncio.create_task(_backfill_order_index(pid, {c['id']: c['order_index'] for c in chs}))
     if chs: await load_chapter(chs[0]['id'])
     else: await refresh_chapter_list()
 
@@ -225,26 +297,27 @@ async def save_all():
     if app_state.current_chapter_id:
         await mgr.pm.update_chapter_content(app_state.current_chapter_id, txt)
         # 实时 RAG 索引
-        if app_state.current_project_id: mgr.rag.index_chapter(app_state.current_project_id, app_state.current_chapter_id, txt)
+        if app_state.current_project_id:
+            rag = await mgr.rag.aget()
+            await rag.aindex_chapter(app_state.current_project_id, app_state.current_chapter_id, txt, await _get_current_chapter_order())
         ui.notify('✅ 已保存 (含RAG更新)')
 
 # ==========================
 # 4. 文件处理
 # ==========================
 async def handle_novel_upload(e, dialog):
-    fname, cbytes = await _extract_upload_info(e)
-    if not cbytes: return ui.notify("文件错误", type='negative')
-    
-    content = cbytes.decode('utf-8', 'ignore')
-    pid = await mgr.pm.create_project(fname, "Imported")
-    await mgr.pm.import_content(pid, content)
+    fname, f, owned = await _open_upload(e)
+    try:
+        if not f or not source_size(f): return ui.notify("文件错误", type='negative')
+        pid = await mgr.pm.create_project(fname, "Imported")
+        # 落盘文件直接交给流式导入器：采样探测编码后按块解码，不生成整本书的字节/字符串副本
+        await mgr.pm.import_content(pid, f, progress_callback=update_status)
+    finally:
+        if owned: f.close()
     
-    # Flash Start: 立即向量化
-    ui.notify('正在初始化向量记忆...', type='info')
-    chs = await mgr.pm.get_chapters(pid)
-    for c in chs:
-        txt = await mgr.pm.get_chapter_content(c['id'])
-        if txt: mgr.rag.index_chapter(pid, c['id'], txt)
+    # Flash Start: 后台批量向量化，项目立即可用 (停止按钮可取消)
+    ui.notify('正在后台初始化向量记忆...', type='info')
+    start_index_job(pid)
     
     with ui.dialog() as d, ui.card():
         ui.label('📚 建立图谱?').classes('font-bold')
@@ -260,18 +333,54 @@ async def handle_novel_upload(e, dialog):
     
     if should_build and GraphEngine:
         await asyncio.sleep(1)
-        asyncio.create_task(bg_build_graph(pid, content))
+        asyncio.create_task(bg_build_graph(pid, await _collect_project_chapters(pid)))
+
+async def clone_memory(old_pid, new_pid, chapter_map):
+    """分页克隆向量记忆 (后台线程)，状态栏显示进度；chapter_map 为 duplicate_project 返回的章节 id 对应关系"""
+    def progress(done, total): update_status(f"正在复制向量记忆 ({done}/{total})...", done / total if total else None)
+    rag = await mgr.rag.aget()
+    await rag.aclone_project_memory(old_pid, new_pid, chapter_map, progress_callback=progress)
+    update_status("向量记忆复制完成", 1.0)
 
 async def create_backup():
     if not app_state.current_project_id: return
     ui.notify('备份中...')
-    nid = await mgr.pm.duplicate_project(app_state.current_project_id, "(副本)")
+    nid, chapter_map = await mgr.pm.duplicate_project(app_state.current_project_id, "(副本)")
     if nid:
-        if mgr.rag: mgr.rag.clone_project_memory(app_state.current_project_id, nid)
+        # 章节副本已就绪；记忆在后台复制，不阻塞继续编辑
+        asyncio.create_task(clone_memory(app_state.current_project_id, nid, chapter_map))
         ui.notify('副本创建成功')
         await refresh_project_list()
 
-async def refresh_backup_list(container): pass # 兼容
+@safe_async
+async def refresh_backup_list(container):
+    """历史面板：列出当前章节的版本，可一键回滚"""
+    if not container: return
+    container.clear()
+    if not app_state.current_chapter_id: return
+    revs = await mgr.pm.list_revisions(app_state.current_chapter_id)
+    with container:
+        if not revs: ui.label('本章暂无历史版本 (保存后自动记录)').classes('text-xs text-gray-400 p-2')
+        for r in revs:
+            with ui.row().classes('w-full items-center justify-between px-2 py-1 border-b text-xs'):
+                ui.label(f"v{r['rev']} · {r['created_at'][5:16].replace('T', ' ')} · {r['size']}字")
+                ui.button('恢复', on_click=lambda _, rev=r['rev']: restore_chapter_revision(rev)).props('flat dense size=sm color=indigo')
+
+async def open_backup_dialog():
+    if app_state.ui['backup_dialog']: app_state.ui['backup_dialog'].open()
+    await refresh_backup_list(app_state.ui['backup_list'])
+
+async def restore_chapter_revision(rev):
+    cid = app_state.current_chapter_id
+    if not cid: return
+    txt = await mgr.pm.restore_revision(cid, rev)
+    if txt is None: return ui.notify('版本不存在', type='negative')
+    if app_state.current_project_id:
+        rag = await mgr.rag.aget()
+        await rag.aindex_chapter(app_state.current_project_id, cid, txt, await mgr.pm.get_chapter_order(cid))
+    await load_chapter(cid)
+    ui.notify(f'已回滚到 v{rev}')
+    await refresh_backup_list(app_state.ui['backup_list'])
 
 # ==========================
 # 5. AI Workflow (核心)
@@ -282,44 +391,81 @@ async def generate_smart_query(target_text, context_prev):
     try:
         conf = app_state.settings.get_role_config('writer').copy()
         conf['system_prompt'] = "Keyword Extractor" 
-        async for token in mgr.llm.stream_rewrite(target_text, prompt, conf): kw += token
+        llm = await mgr.llm.aget()
+        async for token in llm.stream_rewrite(target_text, prompt, conf): kw += token
     except: return target_text
     return kw.strip()
 
+async def keyword_context(keywords, pid, limit=5):
+    """FTS 关键词检索结果，格式与 RAG 上下文一致"""
+    if not pid or not keywords: return ""
+    hits = await mgr.pm.search_chapters(pid, keywords, limit)
+    if not hits: return ""
+    lines = "\n".join(f"- [{hit['title']}] {hit['snippet']}" for hit in hits)
+    return f"【原文检索 (关键词)】：\n{lines}\n"
+
 async def run_analyzer(text, instr):
     ui.notify('军师分析中...', type='info')
-    chap_idx = await _get_current_chapter_index()
-    rag_info = mgr.rag.search_context("核心冲突", app_state.current_project_id) if app_state.current_project_id else ""
-    graph_info = ""
+    # 军师是上帝视角：记忆与图谱都不按章节截断
+    rag_info = ""
+    if app_state.current_project_id:
+        rag = await mgr.rag.aget()
+        rag_info = await rag.asearch_context("核心冲突", app_state.current_project_id)
+    graph_info = ""; fts_info = ""
     if mgr.current_graph_engine:
         kw = await generate_smart_query(text[:500], "")
-        graph_info = mgr.current_graph_engine.query_context(kw, chap_idx, mode='author') # 上帝视角
+        graph_info = mgr.current_graph_engine.query_context(kw, None, mode='author') # 上帝视角
+        fts_info = await keyword_context(kw, app_state.current_project_id)
     
-    prompt = f"【分析】\n指令：{instr}\n片段：{text[:800]}...\n设定：{rag_info}\n图谱：{graph_info}\n请输出简报：1.可行性 2.风险(OOC/伏笔) 3.建议"
+    prompt = f"【分析】\n指令：{instr}\n片段：{text[:800]}...\n设定：{rag_info}\n{fts_info}图谱：{graph_info}\n请输出简报：1.可行性 2.风险(OOC/伏笔) 3.建议"
     sys = assemble_prompt('analyzer')
     conf = app_state.settings.get_role_config('analyzer').copy(); conf['system_prompt'] = sys
     res = ""
-    async for t in mgr.llm.stream_rewrite(text, prompt, conf): res += t
+    llm = await mgr.llm.aget()
+    async for t in llm.stream_rewrite(text, prompt, conf): res += t
     return res
 
-async def _atomic_rewrite_segment(seg, instr, dialog_callback=None):
-    """原子重写：支持 UI 模式和 Batch 模式"""
+# 章节预取时并发提取关键词的上限
+PREFETCH_CONCURRENCY = 4
+# 批量模式每次预取的段落数 (停止时最多浪费这么多段的检索)
+PREFETCH_BATCH = 8
+
+async def prefetch_chapter_context(segs, pid, max_order=None):
+    """
+    批量模式的分批预取：先并发提取各段关键词，再用一次 search_many 取回这批的检索结果。
+    max_order 为所在章节的 order_index (只检索该章及之前的记忆)。
+    返回与 segs 一一对应的 (keywords, rag_res)，交给 _atomic_rewrite_segment。
+    """
+    if not segs or not pid: return []
+    sem = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    async def extract(seg):
+        async with sem: return await generate_smart_query(seg['original'], "")
+    keywords = await asyncio.gather(*(extract(seg) for seg in segs))
+    rag = await mgr.rag.aget()
+    results = await rag.asearch_many(keywords, pid, max_order=max_order)
+    return list(zip(keywords, results))
+
+async def _atomic_rewrite_segment(seg, instr, dialog_callback=None, prefetched=None):
+    """原子重写：支持 UI 模式和 Batch 模式；prefetched 为预取好的 (keywords, rag_res)"""
     target = seg['original'] or ""
     if not target.strip(): return
     
-    chap_idx = await _get_current_chapter_index()
+    chap_order = await _get_current_chapter_order()
     
-    # 1. 知识检索
+    # 1. 知识检索 (Writer 只能看到本章及之前的内容，避免后文剧透)
     rag_res = ""
     keywords = ""
-    if app_state.current_project_id:
+    if prefetched:
+        keywords, rag_res = prefetched
+    elif app_state.current_project_id:
         keywords = await generate_smart_query(target, "")
-        rag_res = mgr.rag.search_context(keywords, app_state.current_project_id)
+        rag = await mgr.rag.aget()
+        rag_res = await rag.asearch_context(keywords, app_state.current_project_id, max_order=chap_order)
         
     graph_res = ""
     if mgr.current_graph_engine and keywords:
         # Writer 只能用 Reader 视角
-        graph_res = mgr.current_graph_engine.query_context(keywords, chap_idx, mode='reader') 
+        graph_res = mgr.current_graph_engine.query_context(keywords, chap_order, mode='reader') 
 
     # 2. Prompt
     sys = assemble_prompt('writer')
@@ -330,8 +476,9 @@ async def _atomic_rewrite_segment(seg, instr, dialog_callback=None):
     
     # 3. 执行 Writer
     res = ""
+    llm = await mgr.llm.aget()
     try:
-        async for t in mgr.llm.stream_rewrite(target, prompt, conf):
+        async for t in llm.stream_rewrite(target, prompt, conf):
             res += t
             # 仅在有 UI 组件时流式更新
             if seg.get('ui_component'): seg['ui_component'].value = res
@@ -347,13 +494,13 @@ async def _atomic_rewrite_segment(seg, instr, dialog_callback=None):
         # Reviewer 用上帝视角
         graph_god = ""
         if mgr.current_graph_engine:
-            graph_god = mgr.current_graph_engine.query_context(keywords, chap_idx, mode='author')
+            graph_god = mgr.current_graph_engine.query_context(keywords, chap_order, mode='author')
             
         rev_prompt = f"【上帝资料】{graph_god}\n【原文】{target}\n【改写】{res}\n【指令】{instr}\n请评分(JSON)"
         
         try:
             rev_res = ""
-            async for t in mgr.llm.stream_rewrite("", rev_prompt, rev_conf): rev_res += t
+            async for t in llm.stream_rewrite("", rev_prompt, rev_conf): rev_res += t
             r_data = clean_json_response(rev_res)
             
             if r_data and r_data.get('score', 0) < app_state.settings.get_review_threshold():
@@ -370,7 +517,7 @@ async def _atomic_rewrite_segment(seg, instr, dialog_callback=None):
                     print(f"[Batch] Reviewer 驳回，自动修正: {r_data.get('suggestion')}")
                     retry_prompt = f"{prompt}\n【总监修改意见 (必须执行)】: {r_data.get('suggestion')}"
                     retry_res = ""
-                    async for t in mgr.llm.stream_rewrite(target, retry_prompt, conf): retry_res += t
+                    async for t in llm.stream_rewrite(target, retry_prompt, conf): retry_res += t
                     seg['revised'] = retry_res # 更新为修正版
                     
         except Exception as e: print(f"Reviewer Error: {e}")
@@ -384,10 +531,14 @@ async def run_seg_logic(idx, instr, dialog_cb):
 # ==========================
 # Batch Task
 # ==========================
+DEFAULT_BATCH_INSTR = "精修文本，保持原意，提升文笔。"
+
 async def open_batch_console():
     if not app_state.current_project_id: return ui.notify('请先导入', type='warning')
     all_chs = await mgr.pm.get_chapters(app_state.current_project_id)
-    task_conf = {'scope': 'current', 'create_backup': True, 'selected': set()}
+    open_job = await mgr.pm.get_open_batch_job(app_state.current_project_id)
+    # 每章保存都会记录版本历史，默认不再整本复制
+    task_conf = {'scope': 'current', 'create_backup': False, 'selected': set()}
     
     def render_ch_list(container):
         container.clear()
@@ -401,10 +552,20 @@ async def open_batch_console():
 
     with ui.dialog() as d, ui.card().classes('w-full max-w-3xl'):
         ui.label('批量任务').classes('text-lg font-bold')
+        if open_job:
+            # 上次任务未完成 (手动停止或意外中断)：已完成的段落直接复用，不再重复调用模型
+            with ui.row().classes('w-full items-center bg-amber-50 border border-amber-200 rounded p-2') as resume_row:
+                ui.label(f"上次任务未完成：{open_job['done']}/{open_job['total']} 章，另有 {open_job['segments']} 段已保存").classes('text-sm text-amber-800')
+                ui.space()
+                async def discard_job():
+                    await mgr.pm.discard_batch_job(app_state.current_project_id)
+                    resume_row.delete()
+                ui.button('放弃', on_click=discard_job).props('flat dense color=grey')
+                ui.button('继续', on_click=lambda: start_batch_execution(task_conf, d, all_chs, resume_job=open_job)).props('dense color=amber')
         with ui.row().classes('w-full gap-4'):
             with ui.column().classes('w-1/3'):
                 ui.radio({'current':'本章','all':'全书'}, value='current', on_change=lambda: render_ch_list(ch_area)).bind_value(task_conf, 'scope')
-                ui.checkbox('创建副本', value=True).bind_value(task_conf, 'create_backup')
+                ui.checkbox('创建副本', value=False).bind_value(task_conf, 'create_backup')
             with ui.column().classes('w-2/3'):
                 ch_area = ui.scroll_area().classes('h-48 border rounded p-2 w-full')
                 render_ch_list(ch_area)
@@ -412,46 +573,91 @@ async def open_batch_console():
             ui.button('启动', on_click=lambda: start_batch_execution(task_conf, d, all_chs)).props('color=indigo')
     d.open()
 
-async def start_batch_execution(conf, dlg, all_chs):
-    ids = conf['selected']
-    if not ids: return ui.notify('无章节')
-    dlg.close()
-    
-    pid = app_state.current_project_id
-    if conf['create_backup']:
-        ui.notify('备份中...')
-        pid = await mgr.pm.duplicate_project(pid, "(批量副本)")
-        if mgr.rag: mgr.rag.clone_project_memory(app_state.current_project_id, pid)
-        await switch_project(pid, app_state.current_project_title+"(批量副本)")
+async def start_batch_execution(conf, dlg, all_chs, resume_job=None):
+    if resume_job:
+        job_id = resume_job['id']
+        global_instr = resume_job['instruction'] or DEFAULT_BATCH_INSTR
+        by_id = {c['id']: c for c in all_chs}
+        targets = [by_id[cid] for cid in await mgr.pm.get_pending_batch_chapters(job_id) if cid in by_id]
+        if not targets:
+            await mgr.pm.set_batch_job_status(job_id, 'done')
+            return ui.notify('上次任务已全部完成')
+        dlg.close()
+        pid = app_state.current_project_id
+    else:
+        ids = conf['selected']
+        if not ids: return ui.notify('无章节')
+        dlg.close()
+        
+        pid = app_state.current_project_id
+        if conf['create_backup']:
+            ui.notify('备份中...')
+            pid, chapter_map = await mgr.pm.duplicate_project(pid, "(批量副本)")
+            # 批量任务马上要检索副本的记忆，等复制完成再开始
+            await clone_memory(app_state.current_project_id, pid, chapter_map)
+            await switch_project(pid, app_state.current_project_title+"(批量副本)")
+            # 副本章节 id 不同，按复制时的 id 对应关系映射过去，断点记录在副本上
+            ids = {chapter_map[cid] for cid in ids if cid in chapter_map}
+            all_chs = await mgr.pm.get_chapters(pid)
+        
+        targets = [c for c in all_chs if c['id'] in ids]
+        global_instr = DEFAULT_BATCH_INSTR
+        job_id = await mgr.pm.create_batch_job(pid, [c['id'] for c in targets], global_instr)
     
+    await mgr.pm.set_batch_job_status(job_id, 'running')
     app_state.is_batch_running = True; app_state.stop_signal = False
-    update_status("批量任务启动...", 0.1)
-    
-    targets = [c for c in all_chs if c['id'] in ids]
-    global_instr = "精修文本，保持原意，提升文笔。"
+    # 本任务 (含章节预取派生的子任务) 的模型调用都按批量优先级排队，交互请求可以插队
+    priority_token = scheduler.priority(PRIORITY_BATCH)
+    update_status("批量任务继续..." if resume_job else "批量任务启动...", 0.1)
     
-    for i, ch in enumerate(targets):
-        if app_state.stop_signal: break
-        update_status(f'处理: {ch["title"]} ({i+1}/{len(targets)})', (i+1)/len(targets))
-        
-        await load_chapter(ch['id'])
-        
-        # 核心循环
-        for seg in app_state.segments:
+    status = 'failed'
+    try:
+        for i, ch in enumerate(targets):
             if app_state.stop_signal: break
-            if not seg['original'].strip(): continue
+            update_status(f'处理: {ch["title"]} ({i+1}/{len(targets)})', (i+1)/len(targets))
             
-            # 【核心修复】调用原子逻辑，不传 dialog_callback，触发自动模式
-            await _atomic_rewrite_segment(seg, global_instr, dialog_callback=None)
+            await load_chapter(ch['id'])
+            checkpoints = await mgr.pm.get_batch_checkpoints(job_id, ch['id'])
             
-            # 稍微暂停，避免 API 速率限制
-            await asyncio.sleep(0.2)
-        
-        await save_all()
-        await mgr.pm.save_progress(pid, ch['id'])
-        
-    app_state.is_batch_running = False
-    update_status("批量任务完成", 1.0)
+            # 断点命中：该位置的原文哈希未变则直接复用改写结果
+            # (中途停止的章节不写回正文，段落序号与原文哈希在续跑时保持不变)
+            todo = []
+            for idx, seg in enumerate(app_state.segments):
+                if not seg['original'].strip(): continue
+                cp = checkpoints.get(idx)
+                if cp and cp[0] == content_key(seg['original']):
+                    if cp[1] != seg['original']: seg['revised'] = cp[1]
+                else:
+                    todo.append(idx)
+            
+            # 核心循环：分批预取 (保存前 RAG 索引不变，结果与逐段检索一致)，停止时不浪费整章的检索
+            finished = True
+            for b in range(0, len(todo), PREFETCH_BATCH):
+                if app_state.stop_signal: finished = False; break
+                part = todo[b:b + PREFETCH_BATCH]
+                prefetched = dict(zip(part, await prefetch_chapter_context([app_state.segments[i] for i in part], pid, ch['order_index'])))
+                for idx in part:
+                    if app_state.stop_signal: finished = False; break
+                    seg = app_state.segments[idx]
+                    
+                    # 【核心修复】调用原子逻辑，不传 dialog_callback，触发自动模式
+                    await _atomic_rewrite_segment(seg, global_instr, dialog_callback=None, prefetched=prefetched.get(idx))
+                    if seg['revised']:
+                        await mgr.pm.save_batch_checkpoint(job_id, ch['id'], idx, seg['original'], seg['revised'])
+                if not finished: break
+            
+            # 整章完成才写回；停止时改写只留在断点里，续跑时按原文哈希对上号
+            if finished:
+                await save_all()
+                await mgr.pm.finish_batch_chapter(job_id, ch['id'])
+                await mgr.pm.save_progress(pid, ch['id'])
+        status = 'paused' if app_state.stop_signal else 'done'
+    finally:
+        # 异常退出记为 failed，下次打开批量面板可继续
+        await mgr.pm.set_batch_job_status(job_id, status)
+        scheduler.reset_priority(priority_token)
+        app_state.is_batch_running = False
+    update_status("批量任务已暂停，可稍后继续" if status == 'paused' else "批量任务完成", 1.0)
 
 # ==========================
 # Chat Logic
@@ -466,24 +672,30 @@ async def send_chat_msg():
     mode = app_state.ui['chat_mode'].value if app_state.ui['chat_mode'] else 'chapter'
     
     ctx = ""
+    rag = await mgr.rag.aget()
     if mode == 'chapter':
         txt = merge_text()
         k = await generate_smart_query(msg, txt[-500:])
-        rag_res = mgr.rag.search_context(k, app_state.current_project_id)
-        graph_res = mgr.current_graph_engine.query_context(k, 999, 'reader') if mgr.current_graph_engine else ""
+        # 本章模式按读者进度回答：只用本章及之前的记忆与关系
+        chap_order = await _get_current_chapter_order()
+        rag_res = await rag.asearch_context(k, app_state.current_project_id, max_order=chap_order)
+        graph_res = mgr.current_graph_engine.query_context(k, chap_order, 'reader') if mgr.current_graph_engine else ""
         ctx = f"【本章】\n{txt[:2000]}\n{rag_res}\n{graph_res}"
     else:
         k = await generate_smart_query(msg, "")
-        rag_res = mgr.rag.search_context(k, app_state.current_project_id)
-        graph_res = mgr.current_graph_engine.query_context(k, 999, 'reader') if mgr.current_graph_engine else ""
-        ctx = f"{rag_res}\n{graph_res}"
+        rag_res = await rag.asearch_context(k, app_state.current_project_id)
+        # 全书模式补充关键词精确检索 (“X 第一次出现在哪”)
+        fts_res = await keyword_context(k, app_state.current_project_id)
+        graph_res = mgr.current_graph_engine.query_context(k, None, 'reader') if mgr.current_graph_engine else ""
+        ctx = f"{rag_res}\n{fts_res}\n{graph_res}"
         
     sys = assemble_prompt('chat')
     conf = app_state.settings.get_role_config('chat').copy(); conf['system_prompt'] = sys
     
     with app_state.ui['chat_container']: bubble = ui.label('Thinking...').classes('chat-bubble chat-ai')
     res = ""; 
+    llm = await mgr.llm.aget()
     try:
-        async for t in mgr.llm.stream_rewrite(f"{ctx}\n问：{msg}", "", conf):
+        async for t in llm.stream_rewrite(f"{ctx}\n问：{msg}", "", conf):
             res += t; bubble.text = res
     except: bubble.text = "Error"
\ No newline at end of file
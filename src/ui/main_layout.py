@@ -7,6 +7,9 @@ import src.logic.handlers as h
 import asyncio
 
 app.on_startup(mgr.init_db)
+app.on_startup(mgr.start_warm_up)
+app.on_shutdown(mgr.close_db)
+app.on_shutdown(mgr.close_llm)
 
 # ==========================
 # CSS 样式补丁
@@ -112,7 +115,8 @@ def create_layout():
                     app_state.full_text_draft = ""; 
                     if app_state.ui.get('full_text_area'): app_state.ui['full_text_area'].value = ""
 
-                async for t in mgr.llm.stream_rewrite(full_text, prompt, conf):
+                llm = await mgr.llm.aget()
+                async for t in llm.stream_rewrite(full_text, prompt, conf):
                     new_text += t
                     if app_state.view_mode == 'full' and app_state.ui.get('full_text_area'):
                         app_state.ui['full_text_area'].value += t
@@ -127,7 +131,7 @@ def create_layout():
                     rev_sys = h.assemble_prompt('reviewer')
                     rev_conf = settings.get_role_config('reviewer').copy(); rev_conf['system_prompt'] = rev_sys
                     rev_res = ""
-                    async for t in mgr.llm.stream_rewrite("", f"原文:{full_text[:2000]}...\n改写:{new_text[:2000]}...\n请评分(JSON)", rev_conf): rev_res += t
+                    async for t in llm.stream_rewrite("", f"原文:{full_text[:2000]}...\n改写:{new_text[:2000]}...\n请评分(JSON)", rev_conf): rev_res += t
                     r_data = h.clean_json_response(rev_res)
 
                     if r_data and r_data.get('score', 0) < settings.get_review_threshold():
@@ -144,7 +148,7 @@ def create_layout():
 
         ui.notify('全文重写完成')
         if mgr.current_graph_engine:
-            asyncio.create_task(mgr.current_graph_engine.extract_from_text_stream(new_text, 999))
+            asyncio.create_task(mgr.current_graph_engine.extract_from_text_stream(new_text, await h._get_current_chapter_order()))
 
     async def run_seg_rewrite_ui(idx):
         seg = app_state.segments[idx]
@@ -235,6 +239,7 @@ def create_layout():
     with ui.dialog() as backup_dlg, ui.card().classes('w-96'):
         ui.label('历史副本').classes('font-bold')
         ui.button('+ 创建副本', on_click=h.create_backup).props('unelevated color=green w-full')
+        ui.label('本章历史版本').classes('text-xs text-gray-500 mt-2')
         app_state.ui['backup_list'] = ui.column().classes('w-full mt-2 h-48 scroll-y border rounded')
         app_state.ui['backup_dialog'] = backup_dlg
 
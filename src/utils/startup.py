@@ -0,0 +1,24 @@
+import os
+import time
+
+# 启动耗时测量：RENOVEL_PROFILE_STARTUP=1 python main.py
+PROFILE_STARTUP = os.environ.get('RENOVEL_PROFILE_STARTUP') == '1'
+# main.py 第一行导入本模块，近似为进程启动时刻
+_T0 = time.perf_counter()
+
+def startup_mark(label: str):
+    """打印距启动的毫秒数 (仅测量模式)"""
+    if PROFILE_STARTUP: print(f"[Startup] {label}: {(time.perf_counter() - _T0) * 1000:.0f} ms")
+
+class timed:
+    """测量模式下记录一段代码的耗时：with timed("RAG 初始化"): ..."""
+    def __init__(self, label: str):
+        self.label = label
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if PROFILE_STARTUP: print(f"[Startup] {self.label} 耗时 {(time.perf_counter() - self.t) * 1000:.0f} ms")
+        return False
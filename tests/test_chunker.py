@@ -0,0 +1,31 @@
+from src.ai.chunker import Chunker
+
+class ByteEncoding:
+    """最坏情况的字节级编码：每个字节一个 token，汉字总是跨 3 个 token"""
+    def encode(self, text, disallowed_special=()):
+        return list(text.encode('utf-8'))
+
+    def decode_bytes(self, tokens):
+        return bytes(tokens)
+
+def byte_chunker(max_tokens):
+    chunker = Chunker(max_tokens=max_tokens, overlap=0, min_line_chars=1)
+    chunker._enc = ByteEncoding()
+    return chunker
+
+def test_split_long_keeps_every_cjk_character():
+    line = "林舟在雨夜里回到旧城，钟楼忽然响了。" * 20 + "end"
+    for max_tokens in (7, 8, 50, 200):
+        parts = byte_chunker(max_tokens)._split_long(line)
+        assert "".join(parts) == line
+        assert all(len(p.encode('utf-8')) <= max_tokens for p in parts)
+
+def test_split_long_limit_below_one_character():
+    # 上限比一个字符所需 token 还小时，每块至少一个完整字符
+    assert byte_chunker(2)._split_long("旧城") == ["旧", "城"]
+
+def test_chunk_over_long_line_loses_nothing():
+    line = "钟楼的钟声在整座旧城上空回荡" * 30
+    chunks = byte_chunker(64).chunk(line)
+    assert "".join(c['text'] for c in chunks) == line
+    assert {(c['line_start'], c['line_end']) for c in chunks} == {(0, 0)}
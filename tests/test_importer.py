@@ -0,0 +1,26 @@
+import io
+import pytest
+
+from src.core.importer import detect_encoding
+
+# 纯中文正文 (无 ASCII)：UTF-16 编码后没有零字节，只能靠打分识别
+PURE_ZH = "第一章重逢那年夏天他回到了北京她站在门口看着他笑了笑说你终于回来了他没有说话只是点了点头" * 40
+MIXED_ZH = "第一章 重逢\n那年夏天，他回到了北京。她站在门口，说：“你终于回来了。”\n" * 40
+ENGLISH = "The quick brown fox jumps over the lazy dog, begging the question.\n" * 50
+
+@pytest.mark.parametrize("encoding", ["utf-16-le", "utf-16-be"])
+@pytest.mark.parametrize("text", [PURE_ZH, MIXED_ZH])
+def test_detects_bomless_utf16_chinese(text, encoding):
+    data = text.encode(encoding)
+    assert detect_encoding(data) == encoding
+    assert detect_encoding(io.BytesIO(data)) == encoding
+
+@pytest.mark.parametrize("text, encoding", [
+    (PURE_ZH, "utf-8"), (PURE_ZH, "gb18030"), (MIXED_ZH, "gb18030"), (ENGLISH, "utf-8"),
+])
+def test_single_byte_families_not_mistaken_for_utf16(text, encoding):
+    assert detect_encoding(text.encode(encoding)) == encoding
+
+def test_bom_wins():
+    assert detect_encoding(PURE_ZH.encode("utf-16")) == "utf-16"
+    assert detect_encoding(PURE_ZH.encode("utf-8-sig")) == "utf-8-sig"
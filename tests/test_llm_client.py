@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+
+pytest.importorskip("httpx")
+from src.ai import llm_client, llm_scheduler
+from src.ai.llm_client import LLMClient
+
+class Chunk:
+    def __init__(self, content):
+        self.content = content
+
+class ServerError(Exception):
+    status_code = 503
+
+class BadRequest(Exception):
+    status_code = 400
+
+class FlakyLLM:
+    """前 failures 次调用抛 error，之后正常输出"""
+    def __init__(self, error, failures=1):
+        self.error, self.failures, self.calls = error, failures, 0
+
+    async def astream(self, messages):
+        self.calls += 1
+        if self.calls <= self.failures: raise self.error
+        yield Chunk("好")
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    monkeypatch.setattr(llm_client, "SystemMessage", lambda content: content)
+    monkeypatch.setattr(llm_client, "HumanMessage", lambda content: content)
+    monkeypatch.setattr(llm_scheduler, "BACKOFF_BASE", 0.0)
+    holder = {}
+    monkeypatch.setattr(LLMClient, "_get_llm", lambda self, config: holder['llm'])
+    def use(llm):
+        holder['llm'] = llm
+        return llm
+    return use
+
+def collect(config=None):
+    async def main():
+        return "".join([t async for t in LLMClient().stream_rewrite("原文", "指令", config or {'model': 'test-transient'})])
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("error", [ServerError(), TimeoutError(), ConnectionResetError()])
+def test_transient_errors_are_retried(fake_llm, error):
+    llm = fake_llm(FlakyLLM(error, failures=2))
+    assert collect() == "好"
+    assert llm.calls == 3
+
+def test_client_errors_are_not_retried(fake_llm):
+    llm = fake_llm(FlakyLLM(BadRequest()))
+    with pytest.raises(BadRequest):
+        collect()
+    assert llm.calls == 1
+
+def test_transient_retries_are_bounded(fake_llm):
+    llm = fake_llm(FlakyLLM(ServerError(), failures=99))
+    with pytest.raises(ServerError):
+        collect()
+    assert llm.calls == llm_scheduler.MAX_RETRIES + 1
+
+def test_is_transient_matches_sdk_class_names():
+    class APITimeoutError(type("APIConnectionError", (Exception,), {})): pass
+    assert llm_scheduler.is_transient(APITimeoutError())
+    assert not llm_scheduler.is_transient(ValueError("bad"))
+
+@pytest.fixture
+def fresh_pools(monkeypatch):
+    monkeypatch.setattr(llm_client, "_pools", {})
+    for key in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'): monkeypatch.setenv(key, "")  # 测试结束时还原
+    return monkeypatch
+
+def uses_proxy(client, url):
+    return client._transport_for_url(llm_client.httpx.URL(url)) is not client._transport
+
+def test_direct_pool_ignores_google_env_proxy(fresh_pools):
+    fresh_pools.setattr(llm_client, "SYSTEM_PROXY", "")
+    llm_client._apply_env_proxy("http://127.0.0.1:7890")  # Google 角色先建
+    sync_client, async_client = llm_client.http_pool("")
+    assert not uses_proxy(sync_client, "https://api.openai.com/v1")
+    assert not uses_proxy(async_client, "https://api.openai.com/v1")
+    proxied, _ = llm_client.http_pool("http://127.0.0.1:7890")
+    assert uses_proxy(proxied, "https://api.openai.com/v1")
+
+def test_direct_pool_keeps_startup_system_proxy(fresh_pools):
+    fresh_pools.setenv("HTTPS_PROXY", "http://10.0.0.1:3128")
+    fresh_pools.setenv("NO_PROXY", "localhost,.internal.example")
+    proxy, no_proxy = llm_client._system_proxy()
+    fresh_pools.setattr(llm_client, "SYSTEM_PROXY", proxy)
+    fresh_pools.setattr(llm_client, "SYSTEM_NO_PROXY", no_proxy)
+    client, _ = llm_client.http_pool("")
+    assert uses_proxy(client, "https://api.openai.com/v1")
+    assert not uses_proxy(client, "http://localhost:11434/v1")
+    assert not uses_proxy(client, "https://llm.internal.example/v1")
@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aiosqlite")
+from src.core.managers import LazyEngine, mgr
+
+class FakeLLM:
+    def __init__(self):
+        self.closed = 0
+
+    async def aclose(self):
+        self.closed += 1
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    built = []
+    def factory():
+        built.append(FakeLLM())
+        return built[-1]
+    monkeypatch.setattr(mgr, "llm", LazyEngine("LLMClient", factory))
+    return built
+
+def test_close_llm_skips_unbuilt_engine(fake_llm):
+    asyncio.run(mgr.close_llm())
+    assert fake_llm == []  # 未构建时不能为了关闭而触发构建
+
+def test_close_llm_closes_built_engine(fake_llm):
+    mgr.llm.get()
+    asyncio.run(mgr.close_llm())
+    assert len(fake_llm) == 1 and fake_llm[0].closed == 1
+
+def test_aget_builds_off_event_loop():
+    import threading
+    loop_thread = []
+    def factory():
+        loop_thread.append(threading.current_thread())
+        return FakeLLM()
+    engine = LazyEngine("LLMClient", factory)
+    first = asyncio.run(engine.aget())
+    assert loop_thread[0] is not threading.main_thread()  # 构建发生在工作线程
+    assert asyncio.run(engine.aget()) is first and len(loop_thread) == 1
@@ -0,0 +1,79 @@
+import asyncio
+import sqlite3
+import pytest
+
+pytest.importorskip("aiosqlite")
+from src.core import project_manager
+from src.core.project_manager import ProjectManager
+from src.core import revision_store as revs
+
+TEXT = "第一段\n\n第二段\n第三段"
+
+def make_baseline_db(path):
+    """初版的库：正文整章内联在 chapters.content"""
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE projects (id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT, created_at TEXT, world_settings TEXT)")
+    db.execute("CREATE TABLE chapters (id TEXT PRIMARY KEY, project_id TEXT, title TEXT, order_index INTEGER, content TEXT, "
+               "FOREIGN KEY(project_id) REFERENCES projects(id))")
+    db.execute("INSERT INTO projects (id, title) VALUES ('p1', '书')")
+    db.execute("INSERT INTO chapters VALUES ('c1', 'p1', '第一章', 1, ?)", (TEXT,))
+    db.commit(); db.close()
+
+def run(pm, coro_fn):
+    async def main():
+        await pm.init_db()
+        try: return await coro_fn()
+        finally: await pm.close_db()
+    return asyncio.run(main())
+
+def test_baseline_db_migrates_to_segments(tmp_path, monkeypatch):
+    path = str(tmp_path / "novel.db")
+    make_baseline_db(path)
+    monkeypatch.setattr(project_manager, "DB_PATH", path)
+    pm = ProjectManager()
+    async def check():
+        assert await pm.get_chapter_segments("c1") == revs.split_segments(TEXT)
+        assert await pm.get_chapter_content("c1") == revs.join_segments(revs.split_segments(TEXT))
+    run(pm, check)
+    db = sqlite3.connect(path)
+    assert db.execute("SELECT content FROM chapters WHERE id = 'c1'").fetchone() == (None,)
+    db.close()
+
+def test_revisions_replay_through_keyframes(tmp_path, monkeypatch):
+    path = str(tmp_path / "novel.db")
+    make_baseline_db(path)
+    monkeypatch.setattr(project_manager, "DB_PATH", path)
+    pm = ProjectManager()
+    versions = [f"第一段\n第{n}版\n第三段" for n in range(revs.KEYFRAME_INTERVAL + 3)]
+    async def check():
+        for text in versions: await pm.update_chapter_content("c1", text)
+        await pm.update_segment("c1", 0, "改过的第一段")
+        revisions = await pm.list_revisions("c1")
+        assert {r['kind'] for r in revisions} == {'segs', 'sdelta'}
+        # v1 为迁移后的原文，之后每次保存一版
+        assert await pm.checkout_revision("c1", 1) == revs.join_segments(revs.split_segments(TEXT))
+        for n, text in enumerate(versions, start=2):
+            assert await pm.checkout_revision("c1", n) == revs.join_segments(revs.split_segments(text))
+        latest = revisions[0]['rev']
+        assert await pm.checkout_revision("c1", latest) == await pm.get_chapter_content("c1")
+        assert await pm.compact_revisions("c1", keep=3) > 0
+        assert await pm.checkout_revision("c1", latest - 2) == revs.join_segments(revs.split_segments(versions[-2]))
+    run(pm, check)
+
+def test_duplicate_project_returns_exact_chapter_map(tmp_path, monkeypatch):
+    path = str(tmp_path / "novel.db")
+    make_baseline_db(path)
+    db = sqlite3.connect(path)
+    # 旧数据里序号可能重复
+    db.execute("INSERT INTO chapters VALUES ('c2', 'p1', '番外', 1, '番外正文')")
+    db.commit(); db.close()
+    monkeypatch.setattr(project_manager, "DB_PATH", path)
+    pm = ProjectManager()
+    async def check():
+        new_pid, chapter_map = await pm.duplicate_project("p1")
+        assert set(chapter_map) == {"c1", "c2"} and len(set(chapter_map.values())) == 2
+        assert {c['id'] for c in await pm.get_chapters(new_pid)} == set(chapter_map.values())
+        for old, new in chapter_map.items():
+            assert await pm.get_chapter_content(new) == await pm.get_chapter_content(old)
+        assert await pm.duplicate_project("missing") == (None, {})
+    run(pm, check)
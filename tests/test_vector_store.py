@@ -0,0 +1,104 @@
+import os
+import pytest
+
+np = pytest.importorskip("numpy")
+from src.ai.embedding_cache import CachedEmbeddingFunction
+from src.ai.vector_store import ChromaStore, NumpyStore, VECTORS_FILE
+
+DIM = 32
+
+class FakeEmbedding:
+    """按字符哈希到固定维度的确定性嵌入，相同文字向量相同、字符重合越多越相近"""
+    def __call__(self, input):
+        out = []
+        for text in input:
+            vec = np.zeros(DIM, dtype=np.float32)
+            for ch in text: vec[ord(ch) % DIM] += 1.0
+            out.append(vec)
+        return out
+
+DOCS = {
+    "a1": ("林舟在雨夜里回到旧城", {"chapter_id": "c1", "order_index": 1}),
+    "a2": ("旧城的钟楼忽然响了", {"chapter_id": "c1", "order_index": 1}),
+    "b1": ("多年后林舟成了钟楼的主人", {"chapter_id": "c2", "order_index": 2}),
+}
+
+@pytest.fixture(params=["numpy", "chroma"])
+def backend(request):
+    if request.param == "chroma": pytest.importorskip("chromadb")
+    return request.param
+
+def open_store(backend, path):
+    # 与 RAGEngine 一样套一层嵌入缓存，两种后端拿到的嵌入函数对象相同
+    emb_fn = CachedEmbeddingFunction(FakeEmbedding(), "fake", path=str(path / "embedding_cache.db"))
+    return (NumpyStore if backend == "numpy" else ChromaStore)(str(path), emb_fn)
+
+@pytest.fixture
+def col(backend, tmp_path):
+    col = open_store(backend, tmp_path).get_collection("novel_p1")
+    col.upsert(ids=list(DOCS), documents=[d for d, _ in DOCS.values()], metadatas=[m for _, m in DOCS.values()])
+    return col
+
+def test_upsert_and_query(col):
+    assert col.count() == 3
+    found = col.query(query_texts=[DOCS["b1"][0]], n_results=3)
+    assert found["ids"][0][0] == "b1"
+    assert found["documents"][0][0] == DOCS["b1"][0]
+    assert found["distances"][0][0] == pytest.approx(0.0, abs=1e-2)
+    # 同 id 再写一次是覆盖
+    col.upsert(ids=["a1"], documents=["林舟改名了"], metadatas=[{"chapter_id": "c1", "order_index": 1}])
+    assert col.count() == 3
+    assert col.get(ids=["a1"])["documents"] == ["林舟改名了"]
+
+def test_query_with_where(col):
+    found = col.query(query_texts=[DOCS["b1"][0]], n_results=3, where={"order_index": {"$lte": 1}})
+    assert sorted(found["ids"][0]) == ["a1", "a2"]
+    assert col.get(where={"chapter_id": "c2"})["ids"] == ["b1"]
+
+def test_delete(col):
+    col.delete(ids=["a2"])
+    assert sorted(col.get()["ids"]) == ["a1", "b1"]
+    col.delete(where={"chapter_id": "c2"})
+    assert col.get()["ids"] == ["a1"]
+    found = col.query(query_texts=[DOCS["b1"][0]], n_results=3)
+    assert found["ids"][0] == ["a1"]
+
+def test_clone_project_memory(backend, tmp_path):
+    pytest.importorskip("chromadb")  # RAGEngine 依赖 chromadb 的默认嵌入函数模块
+    from src.ai.rag_engine import RAGEngine
+    rag = RAGEngine(db_dir=str(tmp_path / "vectordb"), backend=backend, embedding_function=FakeEmbedding())
+    assert os.path.exists(tmp_path / "vectordb" / "embedding_cache.db")  # 缓存跟随 db_dir，不依赖当前目录
+    rag.index_chapter("p1", "c1", "林舟在雨夜里回到旧城\n旧城的钟楼忽然响了", 1)
+    total = rag._collection("p1").count()
+    assert total > 0
+    assert rag.clone_project_memory("p1", "p2", {"c1": "c9"}) == total
+    cloned = rag._collection("p2").get()
+    assert len(cloned["ids"]) == total
+    assert all(i.startswith("p2_c9_") for i in cloned["ids"])
+    assert {m["chapter_id"] for m in cloned["metadatas"]} == {"c9"}
+    assert {m["project_id"] for m in cloned["metadatas"]} == {"p2"}
+    assert "钟楼" in rag.search_context("钟楼", "p2")
+    # 原项目不受影响
+    assert rag._collection("p1").count() == total
+
+def test_numpy_missing_vectors_file_opens_empty(tmp_path):
+    store = NumpyStore(str(tmp_path), FakeEmbedding())
+    col = store.get_collection("novel_p1")
+    col.upsert(ids=list(DOCS), documents=[d for d, _ in DOCS.values()], metadatas=[m for _, m in DOCS.values()])
+    path = col.path
+    col.close()
+    os.remove(os.path.join(path, VECTORS_FILE))
+    reopened = NumpyStore(str(tmp_path), FakeEmbedding()).get_collection("novel_p1")
+    assert reopened.count() == 0
+    assert reopened.query(query_texts=["旧城"], n_results=3)["ids"] == [[]]
+    reopened.upsert(ids=["x"], documents=["旧城"])
+    assert reopened.get()["ids"] == ["x"]
+
+def test_numpy_upsert_dimension_mismatch_leaves_collection_intact(tmp_path):
+    col = NumpyStore(str(tmp_path), FakeEmbedding()).get_collection("novel_p1")
+    col.upsert(ids=["a1"], documents=[DOCS["a1"][0]])
+    with pytest.raises(ValueError):
+        col.upsert(ids=["bad"], embeddings=[[1.0] * (DIM + 1)], documents=["x"])
+    assert col.count() == 1 and col.get()["ids"] == ["a1"]
+    col.upsert(ids=["a2"], documents=[DOCS["a2"][0]])
+    assert sorted(col.get()["ids"]) == ["a1", "a2"]